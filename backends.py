@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+MotionCraft - Frame Extraction Backends
+Extract cover frames and probe videos with the ffmpeg CLI or in-process with PyAV
+以ffmpeg命令列或PyAV（同一行程內解碼）提取封面並探測影片資訊
+"""
+
+import os
+import re
+import json
+import shutil
+import subprocess
+from functools import lru_cache
+
+# 封面提取的時間點
+FRAME_TIMESTAMP = "00:00:00.500"
+FRAME_SECONDS = 0.5
+
+# 沒有 ffprobe 時從 `ffmpeg -i` 的輸出讀取時長和第一個影片串流
+FFMPEG_DURATION = re.compile(r'Duration: (\d+):(\d{2}):(\d{2}(?:\.\d+)?)')
+FFMPEG_VIDEO_STREAM = re.compile(r'Stream #\d+:\d+.*?: Video: (\w+).*?, (\d+)x(\d+)')
+
+class FFmpegBackend:
+    """呼叫外部 ffmpeg/ffprobe 程式"""
+
+    name = 'ffmpeg'
+    # ffmpeg 需要可以 seek 的檔案路徑
+    accepts_file_objects = False
+
+    def is_available(self):
+        return shutil.which('ffmpeg') is not None
+
+    def extract_frame(self, video_path, output_path, thumbnails=None, high_quality=False):
+        """提取封面；有縮圖時以 split/scale 在同一次解碼中輸出"""
+        # 封面之後還會重新編碼時，以最高品質輸出避免二次失真
+        quality = ["-q:v", "1"] if high_quality else []
+        if not thumbnails:
+            command = [
+                "ffmpeg", "-y", "-i", video_path,
+                "-ss", FRAME_TIMESTAMP, "-vframes", "1", *quality, output_path
+            ]
+        else:
+            # split 將解碼後的畫面分給每個輸出，scale 只縮小不放大並保持比例
+            sizes = list(thumbnails)
+            labels = "".join(f"[t{index}]" for index in range(len(sizes)))
+            filters = [f"[0:v]split={len(sizes) + 1}[cover]{labels}"]
+            for index, size in enumerate(sizes):
+                filters.append(
+                    f"[t{index}]scale='min({size},iw)':'min({size},ih)'"
+                    f":force_original_aspect_ratio=decrease[s{index}]"
+                )
+
+            command = ["ffmpeg", "-y", "-i", video_path, "-filter_complex", ";".join(filters),
+                       "-map", "[cover]", "-ss", FRAME_TIMESTAMP, "-vframes", "1", *quality, output_path]
+            for index, size in enumerate(sizes):
+                command += ["-map", f"[s{index}]", "-ss", FRAME_TIMESTAMP, "-vframes", "1", thumbnails[size]]
+
+        result = subprocess.run(command, capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Failed to extract frame: {result.stderr.decode()}")
+
+    def probe(self, video_path):
+        """以 ffprobe 探測；部分安裝只有 ffmpeg，此時改為解析 `ffmpeg -i` 的輸出"""
+        if shutil.which('ffprobe') is None:
+            return self.probe_with_ffmpeg(video_path)
+
+        result = subprocess.run([
+            'ffprobe', '-v', 'quiet', '-select_streams', 'v:0',
+            '-show_entries', 'stream=codec_name,width,height:format=duration',
+            '-of', 'json', video_path
+        ], capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Failed to probe video: {video_path}")
+
+        info = json.loads(result.stdout)
+        stream = (info.get('streams') or [{}])[0]
+        duration = info.get('format', {}).get('duration')
+        return {
+            'codec': stream.get('codec_name'),
+            'width': stream.get('width'),
+            'height': stream.get('height'),
+            'duration': float(duration) if duration else None,
+        }
+
+    def probe_with_ffmpeg(self, video_path):
+        # 沒有指定輸出時 ffmpeg 會以非零狀態結束，但仍會印出輸入資訊
+        result = subprocess.run(['ffmpeg', '-hide_banner', '-i', video_path],
+                                capture_output=True, text=True, errors='replace')
+        if 'Input #0' not in result.stderr:
+            raise RuntimeError(f"Failed to probe video: {video_path}")
+
+        stream = FFMPEG_VIDEO_STREAM.search(result.stderr)
+        duration = FFMPEG_DURATION.search(result.stderr)
+        return {
+            'codec': stream.group(1) if stream else None,
+            'width': int(stream.group(2)) if stream else None,
+            'height': int(stream.group(3)) if stream else None,
+            'duration': (int(duration.group(1)) * 3600 + int(duration.group(2)) * 60 + float(duration.group(3))
+                         if duration else None),
+        }
+
+class PyAVBackend:
+    """以 PyAV 在同一行程內解碼，省去啟動外部程式的成本"""
+
+    name = 'pyav'
+    # av.open() 可以直接讀取可 seek 的檔案物件（例如記憶體中的標準輸入）
+    accepts_file_objects = True
+
+    def is_available(self):
+        try:
+            import av  # noqa: F401
+            import PIL  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def extract_frame(self, video_path, output_path, thumbnails=None, high_quality=False):
+        import av
+
+        with av.open(video_path) as container:
+            stream = container.streams.video[0]
+            stream.thread_type = 'AUTO'
+
+            # 跳到目標時間之前的關鍵幀，再解碼到目標時間
+            if stream.time_base:
+                container.seek(int(FRAME_SECONDS / stream.time_base), stream=stream)
+
+            frame = None
+            for frame in container.decode(stream):
+                if frame.time is not None and frame.time >= FRAME_SECONDS:
+                    break
+            if frame is None:
+                raise RuntimeError(f"Failed to extract frame: no video frames in {video_path}")
+
+            # 與 ffmpeg 的自動旋轉一致，依顯示矩陣轉正
+            image = frame.to_image()
+            rotation = getattr(frame, 'rotation', 0)
+            if rotation:
+                image = image.rotate(rotation, expand=True)
+
+        if high_quality:
+            image.save(output_path, 'JPEG', quality=95, subsampling='4:4:4')
+        else:
+            image.save(output_path, 'JPEG')
+        for size, path in (thumbnails or {}).items():
+            thumbnail = image.copy()
+            thumbnail.thumbnail((size, size))
+            thumbnail.save(path, 'JPEG')
+
+    def probe(self, video_path):
+        import av
+
+        with av.open(video_path) as container:
+            stream = container.streams.video[0]
+            return {
+                'codec': stream.codec_context.name,
+                'width': stream.width,
+                'height': stream.height,
+                'duration': container.duration / av.time_base if container.duration else None,
+            }
+
+# 依速度排列，自動選擇時使用第一個可用的後端
+BACKENDS = [PyAVBackend(), FFmpegBackend()]
+
+@lru_cache(maxsize=None)
+def available_backends():
+    """探測可用的後端（每個行程只探測一次）"""
+    return tuple(backend for backend in BACKENDS if backend.is_available())
+
+def get_backend(name=None):
+    """取得指定名稱的後端；未指定或為 auto 時選擇最快的可用後端"""
+    if name in (None, 'auto'):
+        backends = available_backends()
+        if not backends:
+            raise RuntimeError("No frame extraction backend available (install ffmpeg or PyAV)")
+        return backends[0]
+
+    for backend in BACKENDS:
+        if backend.name == name:
+            if backend not in available_backends():
+                raise RuntimeError(f"Frame extraction backend not available: {name}")
+            return backend
+    raise ValueError(f"Unknown frame extraction backend: {name}")
+
+@lru_cache(maxsize=256)
+def _probe_cached(backend_name, video_path, size, mtime_ns):
+    return get_backend(backend_name).probe(video_path)
+
+def probe_video(video_path, backend=None):
+    """探測影片的編碼、寬、高和時長；相同檔案在同一行程內只探測一次"""
+    stat = os.stat(video_path)
+    return dict(_probe_cached(get_backend(backend).name, str(video_path), stat.st_size, stat.st_mtime_ns))
@@ -0,0 +1,589 @@
+#!/usr/bin/env python3
+"""
+MotionCraft - Batch Conversion Tool
+Convert many videos into Motion Photos, converting identical sources only once
+批次轉換影片為Motion Photo，內容相同的影片只轉換一次
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import errno
+import shutil
+import tarfile
+import hashlib
+import argparse
+import tempfile
+import contextlib
+from pathlib import Path
+
+from main import VIDEO_EXTENSIONS, convert_to_motion_photo, prepare_primary_image, replace_atomically
+from metrics import MetricsSink, stage_timer
+
+# 快速指紋取樣的區塊大小與位置數
+SAMPLE_SIZE = 64 * 1024
+SAMPLE_COUNT = 3
+
+# 完整雜湊的讀取區塊大小
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Linux FICLONE ioctl (見 <linux/fs.h>)
+FICLONE = 0x40049409
+
+# 預設的工作日誌檔名
+JOURNAL_NAME = '.motioncraft-journal.jsonl'
+
+# 後續記錄沒有時，沿用同一工作先前記錄中的欄位
+CARRIED_FIELDS = ('output', 'fingerprint', 'hash', 'source_stat')
+
+def collect_videos(inputs):
+    """展開輸入的檔案和資料夾，回傳 [(影片, 相對路徑)]（保持順序、去除重複路徑）
+
+    相對路徑是影片相對於所在輸入資料夾的路徑（直接指定的檔案只有檔名），用於在輸出資料夾中保留結構。
+    """
+    videos = []
+    seen = set()
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            candidates = [(p, p.relative_to(path)) for p in sorted(path.rglob('*'))
+                          if p.is_file() and p.suffix.lower() in VIDEO_EXTENSIONS]
+        else:
+            candidates = [(path, Path(path.name))]
+        for candidate, relative in candidates:
+            key = os.path.abspath(candidate)
+            if key not in seen:
+                seen.add(key)
+                videos.append((candidate, relative))
+    return videos
+
+def quick_fingerprint(path):
+    """以檔案大小加上開頭、中間、結尾的取樣雜湊作為快速指紋"""
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(size.to_bytes(8, 'big'), digest_size=16)
+    with open(path, 'rb') as f:
+        if size <= SAMPLE_SIZE * SAMPLE_COUNT:
+            digest.update(f.read())
+        else:
+            step = (size - SAMPLE_SIZE) // (SAMPLE_COUNT - 1)
+            for index in range(SAMPLE_COUNT):
+                f.seek(index * step)
+                digest.update(f.read(SAMPLE_SIZE))
+    return size, digest.hexdigest()
+
+def full_hash(path):
+    """計算整個檔案的雜湊"""
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def source_stat(path):
+    """用來判斷來源是否變更的 [大小, 修改時間]；無法讀取時回傳 None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+def group_duplicates(videos, cache=None, known=()):
+    """將內容相同的影片分組，回傳 ([[代表影片, 重複影片...], ...], {無法讀取的影片: OSError})
+
+    先以快速指紋篩選，只有指紋相同的候選才計算完整雜湊確認。
+    cache 為 {影片: {'fingerprint': ..., 'hash': ...}} 時沿用其中已有的值，並將新計算的值加入。
+    無法讀取的影片（不存在、沒有權限）不會分組，由呼叫者記為失敗。
+    known 為已有輸出的影片，指紋必須已在 cache 中；只有與 videos 中的影片指紋相同時才加入分組。
+    """
+    if cache is None:
+        cache = {}
+    errors = {}
+    candidates = {}
+    for video in videos:
+        entry = cache.setdefault(video, {})
+        if 'fingerprint' not in entry:
+            try:
+                entry['fingerprint'] = quick_fingerprint(video)
+            except OSError as e:
+                errors[video] = e
+                continue
+        candidates.setdefault(tuple(entry['fingerprint']), []).append(video)
+
+    for video in known:
+        fingerprint = tuple(cache[video]['fingerprint'])
+        if fingerprint in candidates:
+            candidates[fingerprint].append(video)
+
+    pending = set(videos)
+    groups = {}
+    for fingerprint, members in candidates.items():
+        if len(members) == 1:
+            groups[fingerprint] = members
+            continue
+        for video in members:
+            entry = cache[video]
+            if 'hash' not in entry:
+                try:
+                    entry['hash'] = full_hash(video)
+                except OSError as e:
+                    # 已有輸出的影片無法計算雜湊時只是不沿用它的輸出，不算錯誤
+                    if video in pending:
+                        errors[video] = e
+                    continue
+            groups.setdefault((fingerprint, entry['hash']), []).append(video)
+
+    # 只含已有輸出影片的組不需要處理；依第一次出現的順序排列
+    order = {video: index for index, video in enumerate([*videos, *known])}
+    return sorted((group for group in groups.values() if any(video in pending for video in group)),
+                  key=lambda group: order[group[0]]), errors
+
+def reflink(source, target):
+    """以 FICLONE 建立共享區塊的複本（僅支援部分檔案系統）"""
+    import fcntl
+    with open(source, 'rb') as f_source, open(target, 'wb') as f_target:
+        try:
+            fcntl.ioctl(f_target.fileno(), FICLONE, f_source.fileno())
+        except OSError:
+            f_target.close()
+            os.remove(target)
+            raise
+
+def link_output(source, target, mode='auto'):
+    """以硬連結、reflink 或複製建立重複輸出，回傳實際使用的方式"""
+    if os.path.abspath(source) == os.path.abspath(target):
+        return 'same'
+    if os.path.lexists(target):
+        os.remove(target)
+
+    if mode in ('auto', 'hardlink'):
+        try:
+            os.link(source, target)
+            return 'hardlink'
+        except OSError as e:
+            if mode == 'hardlink' or e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+
+    if mode in ('auto', 'reflink') and sys.platform.startswith('linux'):
+        try:
+            reflink(source, target)
+            return 'reflink'
+        except OSError:
+            if mode == 'reflink':
+                raise
+
+    partial_path = f"{target}.partial"
+    shutil.copyfile(source, partial_path)
+    replace_atomically(partial_path, target)
+    return 'copy'
+
+def output_path_for(video_path, output_dir=None, relative=None):
+    """影片對應的Motion Photo輸出路徑；有輸出資料夾時保留影片相對於輸入資料夾的路徑"""
+    video_path = Path(video_path)
+    if not output_dir:
+        return video_path.with_suffix('.MP.jpg')
+    relative = Path(relative) if relative is not None else Path(video_path.name)
+    return Path(output_dir) / relative.with_suffix('.MP.jpg')
+
+def read_journal(journal_path):
+    """讀取工作日誌，回傳 (工作順序, {路徑: 最後一筆記錄})；忽略寫到一半的最後一行
+
+    最後一筆記錄缺少 CARRIED_FIELDS 中的欄位時，沿用先前記錄的值。
+    """
+    order = []
+    records = {}
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            path = record.get('path')
+            if path is None:
+                continue
+            previous = records.get(path)
+            if previous is None:
+                order.append(path)
+            else:
+                for field in CARRIED_FIELDS:
+                    if field in previous and field not in record:
+                        record[field] = previous[field]
+            records[path] = record
+    return order, records
+
+def open_journal(journal_path, resume=False):
+    """開啟工作日誌；恢復時先截斷寫到一半的最後一行，新記錄才不會接在殘片後面"""
+    if resume and os.path.exists(journal_path):
+        with open(journal_path, 'r+b') as f:
+            end = f.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                start = max(0, position - 64 * 1024)
+                f.seek(start)
+                newline = f.read(position - start).rfind(b'\n')
+                if newline >= 0:
+                    position = start + newline + 1
+                    break
+                position = start
+            if position < end:
+                f.truncate(position)
+    return open(journal_path, 'a' if resume else 'w', encoding='utf-8')
+
+def journal_record(path, state, **fields):
+    """建立一筆工作狀態記錄 (queued, running, done, failed)"""
+    record = {'path': path, 'state': state, 'time': time.time()}
+    record.update(fields)
+    return record
+
+def write_journal(journal, records):
+    """一次寫入多筆記錄，只同步到磁碟一次"""
+    if not records:
+        return
+    journal.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+    journal.flush()
+    os.fsync(journal.fileno())
+
+def append_journal(journal, path, state, **fields):
+    """寫入一筆工作狀態並同步到磁碟"""
+    write_journal(journal, [journal_record(path, state, **fields)])
+
+def is_finished(record):
+    """日誌記錄為完成，且輸出檔案仍存在並與記錄的大小一致"""
+    if record is None or record.get('state') != 'done':
+        return False
+    output = record.get('output')
+    try:
+        return os.path.getsize(output) == record.get('size')
+    except (OSError, TypeError):
+        return False
+
+def convert_batch(inputs, output_dir=None, dedup=True, link_mode='auto',
+                  journal_path=None, resume=False, retry_failed=False, metrics=None, verify=False):
+    """批次轉換影片，回傳 (成功數, 失敗數)
+
+    每個工作的狀態會附加到工作日誌；resume 時跳過已完成（且輸出完整）的工作。
+    metrics 為 MetricsSink 時，每個工作完成後都會更新指標檔案。
+    verify 為 True 時每個轉換都在寫入時驗證（見 convert_to_motion_photo）。
+    """
+    if journal_path is None:
+        journal_path = Path(output_dir or '.') / JOURNAL_NAME
+
+    records = {}
+    if resume and os.path.exists(journal_path):
+        order, records = read_journal(journal_path)
+        videos = [Path(path) for path in order]
+        # 額外指定的輸入加到日誌中的工作之後
+        known = set(order)
+        collected = collect_videos(inputs)
+        relatives = {video.absolute(): relative for video, relative in collected}
+        videos += [video for video, _ in collected if str(video.absolute()) not in known]
+        print(f"📒 從工作日誌恢復: {journal_path} ({len(order)} 個工作)")
+    else:
+        if resume:
+            print(f"⚠️ 找不到工作日誌，重新開始: {journal_path}")
+        collected = collect_videos(inputs)
+        relatives = {video.absolute(): relative for video, relative in collected}
+        videos = [video for video, _ in collected]
+    videos = [video.absolute() for video in videos]
+
+    if not videos:
+        print("❌ 沒有找到影片檔案")
+        return 0, 0
+
+    if output_dir:
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+    journal = open_journal(journal_path, resume)
+    try:
+        # 規劃輸出路徑：同一次執行中，不同來源不能寫到同一個輸出
+        planned = {}
+        outputs = {}
+        owners = {}
+        collisions = []
+        for video in videos:
+            record = records.get(str(video), {})
+            if record.get('output'):
+                output = Path(record['output'])
+            else:
+                output = output_path_for(video, output_dir, relatives.get(video))
+            planned[video] = output
+            owner = owners.setdefault(os.path.abspath(output), video)
+            if owner == video:
+                outputs[video] = output
+            else:
+                collisions.append((video, owner, output))
+
+        # 新工作與輸出衝突的結果一起寫入，只同步一次
+        pending = [journal_record(str(video), 'queued', output=str(planned[video].absolute()))
+                   for video in videos if str(video) not in records]
+        for video, owner, output in collisions:
+            print(f"❌ 輸出 {output} 已屬於 {owner}，無法轉換 {video}")
+            pending.append(journal_record(str(video), 'failed', error=f'output collision with {owner}'))
+        write_journal(journal, pending)
+        if metrics is not None and collisions:
+            metrics.inc('conversions_total', len(collisions), result='failure')
+            metrics.write()
+        videos = [video for video in videos if video in outputs]
+
+        finished = {video for video in videos if is_finished(records.get(str(video)))}
+        skipped = {video for video in videos
+                   if not retry_failed and records.get(str(video), {}).get('state') == 'failed'}
+        if resume:
+            print(f"⏭️ 跳過 {len(finished)} 個已完成, {len(skipped)} 個先前失敗的工作")
+
+        # 來源未變更時沿用日誌中記錄的指紋與雜湊，不必重新讀取檔案
+        todo = [video for video in videos if video not in finished and video not in skipped]
+        content = {}
+        for video in todo:
+            record = records.get(str(video), {})
+            entry = content[video] = {'source_stat': source_stat(video)}
+            if entry['source_stat'] is not None and record.get('source_stat') == entry['source_stat']:
+                entry.update({field: record[field] for field in ('fingerprint', 'hash') if field in record})
+
+        # 已完成的工作以記錄的指紋代表它輸出的內容，不讀取來源（來源可能已被移除）；
+        # 沒有記錄雜湊時，只有來源未變更才能在需要時補算
+        known = []
+        for video in videos:
+            record = records.get(str(video), {})
+            if video not in finished or 'fingerprint' not in record:
+                continue
+            if 'hash' not in record and record.get('source_stat') != source_stat(video):
+                continue
+            content[video] = {field: record[field] for field in ('fingerprint', 'hash', 'source_stat')
+                              if field in record}
+            known.append(video)
+
+        unreadable = {}
+        if dedup:
+            print(f"🔍 比對 {len(todo)} 個影片的內容指紋...")
+            groups, unreadable = group_duplicates(todo, content, known)
+            sources = sum(1 for group in groups if not any(video in finished for video in group))
+            duplicate_count = len(todo) - len(unreadable) - sources
+            print(f"📊 {sources} 個不重複影片, {duplicate_count} 個重複影片")
+        else:
+            groups = [[video] for video in todo]
+
+        for video, error in unreadable.items():
+            print(f"❌ 無法讀取影片 {video}: {error}")
+        write_journal(journal, [journal_record(str(video), 'failed', error=str(error))
+                                for video, error in unreadable.items()])
+        if metrics is not None and unreadable:
+            metrics.inc('conversions_total', len(unreadable), result='failure')
+            metrics.write()
+
+        succeeded = len(finished)
+        failed = len(skipped) + len(collisions) + len(unreadable)
+        for index, group in enumerate(groups, 1):
+            remaining = [video for video in group if video not in finished and video not in skipped]
+            if not remaining:
+                continue
+            print(f"\n[{index}/{len(groups)}] {remaining[0]}")
+
+            # 同組已有完成的輸出時直接沿用，否則轉換第一個影片
+            done = [video for video in group if video in finished]
+            if done:
+                output_path = records[str(done[0])]['output']
+            else:
+                source = remaining.pop(0)
+                output_path = outputs[source]
+                output_path.parent.mkdir(parents=True, exist_ok=True)
+                append_journal(journal, str(source), 'running')
+                if not convert_to_motion_photo(source, output_path, metrics=metrics, verify=verify):
+                    append_journal(journal, str(source), 'failed', error='conversion failed')
+                    for duplicate in remaining:
+                        append_journal(journal, str(duplicate), 'failed', error='conversion failed')
+                    failed += 1 + len(remaining)
+                    if metrics is not None and remaining:
+                        metrics.inc('conversions_total', len(remaining), result='failure')
+                        metrics.write()
+                    continue
+                append_journal(journal, str(source), 'done', output=str(Path(output_path).absolute()),
+                               size=os.path.getsize(output_path), **content[source])
+                succeeded += 1
+
+            for duplicate in remaining:
+                duplicate_output = outputs[duplicate]
+                append_journal(journal, str(duplicate), 'running')
+                try:
+                    duplicate_output.parent.mkdir(parents=True, exist_ok=True)
+                    method = link_output(output_path, duplicate_output, link_mode)
+                    print(f"♻️ 重複影片 {duplicate} → {duplicate_output} ({method})")
+                    append_journal(journal, str(duplicate), 'done', output=str(duplicate_output.absolute()),
+                                   size=os.path.getsize(duplicate_output), **content[duplicate])
+                    succeeded += 1
+                    result = 'deduplicated'
+                except OSError as e:
+                    print(f"❌ 無法建立重複輸出 {duplicate_output}: {e}")
+                    append_journal(journal, str(duplicate), 'failed', error=str(e))
+                    failed += 1
+                    result = 'failure'
+                if metrics is not None:
+                    metrics.inc('conversions_total', result=result)
+                    metrics.write()
+    finally:
+        journal.close()
+
+    print("\n" + "=" * 60)
+    print(f"🎉 批次轉換完成: {succeeded} 個成功, {failed} 個失敗")
+    return succeeded, failed
+
+class ChainedReader:
+    """依序讀取多個檔案物件，讓主要圖片和影片數據以單一串流寫入tar"""
+
+    def __init__(self, *sources):
+        self.sources = list(sources)
+
+    def read(self, size=-1):
+        chunks = []
+        while self.sources and size != 0:
+            chunk = self.sources[0].read(size)
+            if not chunk:
+                self.sources.pop(0)
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b''.join(chunks)
+
+def tar_member_name(video_path, used_names):
+    """tar中的檔名：相對於目前目錄的路徑（無法表示時用檔名），重複時加上序號"""
+    relative = os.path.relpath(video_path)
+    if relative.startswith('..'):
+        relative = os.path.basename(video_path)
+    base = Path(relative).with_suffix('').as_posix()
+    name = f"{base}.MP.jpg"
+    counter = 1
+    while name in used_names:
+        name = f"{base}.{counter}.MP.jpg"
+        counter += 1
+    used_names.add(name)
+    return name
+
+def convert_batch_to_tar(inputs, tar_output, dedup=True, metrics=None):
+    """批次轉換並直接寫入tar串流（路徑或二進位檔案物件），回傳 (成功數, 失敗數)
+
+    Motion Photo不會寫到磁碟：主要圖片在記憶體中產生，影片數據分塊串流進tar。
+    重複的影片以tar硬連結項目指向第一個成員。
+    """
+    videos = [video for video, _ in collect_videos(inputs)]
+    if not videos:
+        print("❌ 沒有找到影片檔案")
+        return 0, 0
+
+    unreadable = {}
+    if dedup:
+        groups, unreadable = group_duplicates(videos)
+        print(f"📊 {len(groups)} 個不重複影片, {len(videos) - len(unreadable) - len(groups)} 個重複影片")
+    else:
+        groups = [[video] for video in videos]
+
+    for video, error in unreadable.items():
+        print(f"❌ 無法讀取影片 {video}: {error}")
+    if metrics is not None and unreadable:
+        metrics.inc('conversions_total', len(unreadable), result='failure')
+        metrics.write()
+
+    succeeded = 0
+    failed = len(unreadable)
+    used_names = set()
+    owns_stream = isinstance(tar_output, (str, os.PathLike))
+    stream = open(tar_output, 'wb') if owns_stream else tar_output
+    try:
+        with tarfile.open(fileobj=stream, mode='w|', format=tarfile.PAX_FORMAT) as tar, \
+                tempfile.TemporaryDirectory() as work_dir:
+            for index, group in enumerate(groups, 1):
+                source = group[0]
+                print(f"\n[{index}/{len(groups)}] {source}")
+                try:
+                    primary_image, video_size = prepare_primary_image(
+                        str(source), os.path.join(work_dir, 'cover.jpg'), metrics=metrics)
+                except Exception as e:
+                    print(f"❌ 轉換失敗: {e}")
+                    failed += len(group)
+                    if metrics is not None:
+                        metrics.inc('conversions_total', len(group), result='failure')
+                        metrics.write()
+                    continue
+
+                # 大小在寫入前就已知：主要圖片 + Container中記錄的影片長度
+                member = tarfile.TarInfo(tar_member_name(source, used_names))
+                member.size = len(primary_image) + video_size
+                member.mtime = int(time.time())
+                member.mode = 0o644
+                with stage_timer(metrics, 'write'), open(source, 'rb') as f_video:
+                    tar.addfile(member, ChainedReader(io.BytesIO(primary_image), f_video))
+                print(f"📦 已寫入tar: {member.name} ({member.size:,} bytes)")
+                succeeded += 1
+
+                for duplicate in group[1:]:
+                    link = tarfile.TarInfo(tar_member_name(duplicate, used_names))
+                    link.type = tarfile.LNKTYPE
+                    link.linkname = member.name
+                    link.mtime = member.mtime
+                    link.mode = member.mode
+                    tar.addfile(link)
+                    print(f"♻️ 重複影片 {duplicate} → {link.name} (tar硬連結)")
+                    succeeded += 1
+
+                if metrics is not None:
+                    metrics.inc('conversions_total', result='success')
+                    metrics.inc('conversions_total', len(group) - 1, result='deduplicated')
+                    metrics.inc('bytes_processed_total', video_size, direction='read')
+                    metrics.inc('bytes_processed_total', member.size, direction='written')
+                    metrics.observe_size('video', video_size)
+                    metrics.observe_size('primary_image', len(primary_image))
+                    metrics.observe_size('motion_photo', member.size)
+                    metrics.write()
+    finally:
+        if owns_stream:
+            stream.close()
+        else:
+            stream.flush()
+
+    print("\n" + "=" * 60)
+    print(f"🎉 批次轉換完成: {succeeded} 個成功, {failed} 個失敗")
+    return succeeded, failed
+
+def main():
+    parser = argparse.ArgumentParser(description='批次轉換影片為Motion Photo')
+    parser.add_argument('inputs', nargs='*', help='影片檔案或資料夾（資料夾會遞迴搜尋）')
+    parser.add_argument('--output-dir', help='輸出資料夾（預設與影片相同）')
+    parser.add_argument('--no-dedup', action='store_true', help='不比對重複影片')
+    parser.add_argument('--link', choices=['auto', 'hardlink', 'reflink', 'copy'], default='auto',
+                        help='重複影片輸出的建立方式（預設 auto: 硬連結 → reflink → 複製）')
+    parser.add_argument('--journal', help=f'工作日誌路徑（預設為 <輸出資料夾>/{JOURNAL_NAME}）')
+    parser.add_argument('--resume', action='store_true', help='從工作日誌繼續上次中斷的批次')
+    parser.add_argument('--retry-failed', action='store_true', help='恢復時重試先前失敗的工作')
+    parser.add_argument('--tar', metavar='FILE', help="將結果直接串流寫入tar檔（'-' 為標準輸出），不寫出 .MP.jpg")
+    parser.add_argument('--metrics-file', help='將Prometheus指標寫到此檔案，每個工作完成後更新')
+    parser.add_argument('--verify', action='store_true', help='每個轉換寫入後立即驗證（不能與 --tar 一起使用）')
+    args = parser.parse_args()
+    metrics = MetricsSink(args.metrics_file) if args.metrics_file else None
+
+    if not args.inputs and not args.resume:
+        parser.error('請指定影片檔案或資料夾，或使用 --resume')
+
+    if args.tar:
+        if args.resume or args.verify:
+            parser.error('--tar 不能與 --resume 或 --verify 一起使用')
+        # 輸出到標準輸出時，進度訊息改寫到標準錯誤
+        if args.tar == '-':
+            tar_output = sys.stdout.buffer
+            redirect = contextlib.redirect_stdout(sys.stderr)
+        else:
+            tar_output = args.tar
+            redirect = contextlib.nullcontext()
+        with redirect:
+            _, failed = convert_batch_to_tar(args.inputs, tar_output, not args.no_dedup, metrics)
+        sys.exit(1 if failed else 0)
+
+    _, failed = convert_batch(args.inputs, args.output_dir, not args.no_dedup, args.link,
+                              args.journal, args.resume, args.retry_failed, metrics, args.verify)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -8,9 +8,10 @@ Showcase Motion Photo features and capabilities
 import os
 import sys
 import subprocess
-import re
 from pathlib import Path
 
+from main import COPY_CHUNK_SIZE, LAYOUT_NAMES, locate_motion_photo_video
+
 def show_banner():
     print("🎬✨ MotionCraft - Interactive Demo")
     print("   Where videos come alive in photographs")
@@ -78,7 +79,7 @@ def demo_metadata(filepath):
                 print(f"   🎯 Motion Photo: {motion_photo}")
             if version == '1':
                 print(f"   📋 版本: {version}")
-            if timestamp == '0':
+            if timestamp is not None:
                 print(f"   ⏰ 時間戳: {timestamp}")
             
             # 檢查Container信息
@@ -106,86 +107,73 @@ def demo_video_extraction(filepath):
     print("\n3️⃣ 提取內嵌影片:")
     
     try:
-        # 從原始XMP中獲取Container信息
-        result = subprocess.run([
-            'exiftool', '-b', '-XMP', filepath
-        ], capture_output=True, text=True)
+        # 依序嘗試 Container XMP、MicroVideoOffset 和廠商尾端標記，只讀取少量數據
+        with open(filepath, 'rb') as f:
+            layout = locate_motion_photo_video(f)
+        video_offset = layout['video_offset']
+        video_size = layout['video_size']
         
-        if result.returncode == 0:
-            xmp_content = result.stdout
-            
-            # 解析Container:Length信息
-            length_matches = re.findall(r'<Container:Length>(\d+)</Container:Length>', xmp_content)
+        print(f"   🧭 格式: {LAYOUT_NAMES.get(layout['layout'], layout['layout'])}")
+        print(f"   📏 影片偏移: {video_offset:,} bytes")
+        print(f"   🎥 內嵌影片大小: {video_size:,} bytes")
+        
+        # 提取影片到臨時檔案
+        temp_video = "demo_extracted.mp4"
+        try:
+            with open(filepath, 'rb') as f, open(temp_video, 'wb') as f_out:
+                # 跳到影片數據的開始位置，分塊複製
+                f.seek(video_offset)
+                remaining = video_size
+                while remaining > 0:
+                    chunk = f.read(min(COPY_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    f_out.write(chunk)
+                    remaining -= len(chunk)
             
-            if len(length_matches) >= 2:
-                primary_size = int(length_matches[0])  # 第一個是Primary圖片
-                video_size = int(length_matches[1])    # 第二個是MotionPhoto影片
-                
-                print(f"   📏 Primary圖片大小: {primary_size:,} bytes")
-                print(f"   🎥 內嵌影片大小: {video_size:,} bytes")
+            # 檢查影片數據是否有效
+            if remaining == 0 and video_size > 8:
+                print(f"   ✅ 影片已提取: {temp_video}")
                 
-                # 提取影片到臨時檔案
-                temp_video = "demo_extracted.mp4"
+                # 嘗試分析影片信息
                 try:
-                    with open(filepath, 'rb') as f:
-                        # 跳到影片數據的開始位置（Primary圖片之後）
-                        f.seek(primary_size)
-                        video_data = f.read(video_size)
+                    result = subprocess.run([
+                        'ffprobe', '-v', 'quiet', '-select_streams', 'v:0',
+                        '-show_entries', 'stream=width,height,duration',
+                        '-of', 'csv=p=0', temp_video
+                    ], capture_output=True, text=True)
                     
-                    # 檢查影片數據是否有效
-                    if len(video_data) == video_size and len(video_data) > 8:
-                        with open(temp_video, 'wb') as f:
-                            f.write(video_data)
-                        
-                        print(f"   ✅ 影片已提取: {temp_video}")
-                        
-                        # 嘗試分析影片信息
-                        try:
-                            result = subprocess.run([
-                                'ffprobe', '-v', 'quiet', '-select_streams', 'v:0',
-                                '-show_entries', 'stream=width,height,duration',
-                                '-of', 'csv=p=0', temp_video
-                            ], capture_output=True, text=True)
-                            
-                            if result.returncode == 0:
-                                info = result.stdout.strip().split(',')
-                                if len(info) >= 3:
-                                    width, height, duration = info
-                                    print(f"   📐 影片解析度: {width}x{height}")
-                                    print(f"   ⏱️ 影片時長: {float(duration):.2f}秒")
-                                else:
-                                    print("   ✅ 影片檔案有效")
-                        except FileNotFoundError:
-                            print("   📝 需要ffprobe來分析影片詳情")
-                        except Exception as e:
-                            print(f"   ⚠️ 影片分析失敗: {e}")
-                        
-                        # 清理臨時檔案
-                        try:
-                            os.remove(temp_video)
-                            print(f"   🗑️ 已清理臨時檔案")
-                        except:
-                            pass
-                        
-                        return True
-                    else:
-                        print("   ❌ 影片數據無效")
-                        return False
-                
+                    if result.returncode == 0:
+                        info = result.stdout.strip().split(',')
+                        if len(info) >= 3:
+                            width, height, duration = info
+                            print(f"   📐 影片解析度: {width}x{height}")
+                            print(f"   ⏱️ 影片時長: {float(duration):.2f}秒")
+                        else:
+                            print("   ✅ 影片檔案有效")
+                except FileNotFoundError:
+                    print("   📝 需要ffprobe來分析影片詳情")
                 except Exception as e:
-                    print(f"   ❌ 提取影片失敗: {e}")
-                    return False
-            
-            elif len(length_matches) == 1:
-                print("   ⚠️ 只找到一個Length值，可能缺少影片數據")
-                return False
+                    print(f"   ⚠️ 影片分析失敗: {e}")
+                
+                return True
             else:
-                print("   ⚠️ 未找到Container:Length信息")
+                print("   ❌ 影片數據無效")
                 return False
-        else:
-            print("   ❌ 無法獲取XMP內容")
+        
+        except Exception as e:
+            print(f"   ❌ 提取影片失敗: {e}")
             return False
-            
+        
+        finally:
+            # 清理臨時檔案
+            if os.path.exists(temp_video):
+                os.remove(temp_video)
+                print(f"   🗑️ 已清理臨時檔案")
+    
+    except ValueError as e:
+        print(f"   ⚠️ {e}")
+        return False
     except Exception as e:
         print(f"   ❌ 提取影片時發生錯誤: {e}")
         return False
@@ -221,12 +209,21 @@ def demo_file_structure(filepath):
                             break
                         else:
                             break
+                    elif marker == b'\xff\xff':
+                        # 填充字節，退回一個字節重新讀取標記
+                        f.seek(-1, 1)
+                    elif marker in (b'\xff\xda', b'\xff\xd9'):
+                        # SOS/EOI之後沒有APP段
+                        break
                     else:
                         # 跳過其他段
                         if marker[0] == 0xff:
                             length_bytes = f.read(2)
                             if len(length_bytes) == 2:
                                 length = int.from_bytes(length_bytes, 'big')
+                                if length < 2:
+                                    # 長度無效，避免原地重複讀取
+                                    break
                                 f.seek(length - 2, 1)
                             else:
                                 break
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+MotionCraft - JPEG/XMP Parser Stress Tool
+Benchmark and fuzz the JPEG/XMP code paths with pathological inputs
+以惡意或損壞的輸入測試JPEG/XMP處理的正確性與時間複雜度
+"""
+
+import io
+import os
+import sys
+import time
+import random
+import signal
+import argparse
+import tempfile
+import contextlib
+from pathlib import Path
+
+from main import (
+    XMP_NAMESPACE, build_primary_image, find_xmp_segment, iter_jpeg_segments, locate_motion_photo_video,
+    read_motion_photo_layout, remove_existing_xmp, strip_app_segments,
+)
+from demo import demo_file_structure
+
+# 小、大兩種輸入大小；大輸入的處理時間不應超過 (大小倍數 × SLACK) 倍
+SMALL_SIZE = 64 * 1024
+SIZE_FACTOR = 8
+SLACK = 4
+
+# 低於此時間的量測視為雜訊，不做倍數比較（秒）
+NOISE_FLOOR = 0.005
+
+# 單次呼叫的時間上限（秒），超過視為卡住
+CALL_TIMEOUT = 5.0
+
+SOI = b'\xff\xd8'
+EOI = b'\xff\xd9'
+
+def segment(marker, payload):
+    """建構一個帶長度欄位的標記段"""
+    return bytes([0xFF, marker]) + (len(payload) + 2).to_bytes(2, 'big') + payload
+
+def xmp_segment(size=64):
+    """建構指定內容大小的XMP段"""
+    return segment(0xE1, XMP_NAMESPACE + b' ' * size)
+
+def baseline_tables():
+    """最小的 DQT/SOF0/DHT 段（不需要可解碼）"""
+    return (segment(0xDB, b'\x00' + bytes(range(1, 65)))
+            + segment(0xC0, b'\x08\x00\x10\x00\x10\x01\x01\x11\x00')
+            + segment(0xC4, b'\x00' + b'\x01' + b'\x00' * 15 + b'\x00'))
+
+def scan(size):
+    """SOS段加上指定大小的熵編碼數據"""
+    return segment(0xDA, b'\x01\x01\x00\x00\x3f\x00') + b'\x55' * size + EOI
+
+# 每個案例以大小參數 n 產生輸入
+CASES = {
+    # 大量 0xFF 填充字節
+    'ff_fill': lambda n: SOI + b'\xff' * n + xmp_segment() + baseline_tables() + scan(64),
+    # 段之間的雜散字節，沒有SOS
+    'stray_bytes': lambda n: SOI + segment(0xE0, b'JFIF\x00') + b'\x00' * n,
+    # 大量非XMP的APP1段，其中穿插XMP段
+    'many_app1': lambda n: SOI + b''.join(
+        xmp_segment() if index % 10 == 0 else segment(0xE1, b'Exif\x00\x00' + b'\x00' * 58)
+        for index in range(n // 68)) + scan(64),
+    # 全部都是XMP段
+    'many_xmp': lambda n: SOI + xmp_segment() * (n // 100) + scan(64),
+    # 接近 65535 上限的XMP段，加上大的熵編碼數據
+    'oversized_xmp': lambda n: SOI + xmp_segment(65533 - 2 - len(XMP_NAMESPACE)) + baseline_tables() + scan(n),
+    # 宣稱的長度超過實際資料
+    'truncated_segment': lambda n: SOI + segment(0xE0, b'JFIF\x00') + b'\xff\xe1\xff\xff' + XMP_NAMESPACE + b'x' * n,
+    # 長度欄位為 0 或 1 的段
+    'zero_length': lambda n: SOI + b'\xff\xe1\x00\x00' * (n // 4),
+    # 只有APP段，沒有SOS也沒有EOI
+    'no_sos': lambda n: SOI + segment(0xE2, b'\x00' * 1000) * (n // 1004),
+    # 熵編碼數據中出現看起來像XMP段的字節（不可被移除）
+    'fake_xmp_in_scan': lambda n: SOI + baseline_tables() + segment(0xDA, b'\x01\x01\x00\x00\x3f\x00')
+        + (b'\xff\xe1\x00\x40' + XMP_NAMESPACE + b'\x00' * 30) * (n // 64) + EOI,
+    # 尾端的SEF目錄宣稱大量項目，且項目指向檔案範圍外
+    'bogus_sef_trailer': lambda n: SOI + b'\x00' * n + b'MotionPhoto_Data'
+        + b'SEFH' + b'\x6a\x00\x00\x00' + b'\xff\xff\xff\xff' + b'\x00\x00\x30\x0a\xff\xff\xff\x7f\xff\xff\xff\xff' * 4
+        + (12 + 12 * 4).to_bytes(4, 'little') + b'SEFT',
+    # 亂數資料
+    'random': lambda n: SOI + random.Random(n).randbytes(n),
+}
+
+def xmp_segment_sizes(jpeg_data):
+    """列出標頭中所有XMP段的大小"""
+    return [end - offset for offset, marker, end in iter_jpeg_segments(jpeg_data)
+            if marker == 0xE1 and jpeg_data.startswith(XMP_NAMESPACE, offset + 4, end)]
+
+def check_remove_existing_xmp(data):
+    output = remove_existing_xmp(data)
+    assert output[:2] == SOI, "輸出缺少SOI"
+    assert not xmp_segment_sizes(output), "輸出仍有XMP段"
+    assert len(output) == len(data) - sum(xmp_segment_sizes(data)), "移除了XMP以外的數據"
+    assert remove_existing_xmp(output) == output, "結果不是冪等的"
+
+def check_strip_app_segments(data):
+    output = strip_app_segments(data)
+    assert output[:2] == SOI, "輸出缺少SOI"
+    assert len(output) <= len(data), "輸出比輸入大"
+    assert strip_app_segments(output) == output, "結果不是冪等的"
+
+def check_primary_image(primary_image, video_size):
+    """主要圖片的XMP必須可被找到，且Container長度與實際大小一致"""
+    assert len(xmp_segment_sizes(primary_image)) == 1, "主要圖片應只有一個XMP段"
+    layout = read_motion_photo_layout(io.BytesIO(primary_image + b'\x00' * video_size))
+    assert layout['video_offset'] == len(primary_image), "Container長度與主要圖片大小不一致"
+    assert layout['video_size'] == video_size, "影片長度錯誤"
+
+def check_build_primary_image(data):
+    try:
+        primary_image = build_primary_image(data, 1000, padding=0)
+    except ValueError:
+        return  # 拒絕無效的輸入是可接受的結果
+    check_primary_image(primary_image, 1000)
+
+def check_find_xmp_segment(data):
+    found = find_xmp_segment(io.BytesIO(data))
+    if found is not None:
+        offset, size, _ = found
+        assert 2 <= offset and offset + size <= len(data), "XMP段超出檔案範圍"
+
+def check_locate_motion_photo_video(data):
+    try:
+        layout = locate_motion_photo_video(io.BytesIO(data))
+    except ValueError:
+        return
+    assert 0 <= layout['video_offset'] and layout['video_size'] > 0, "影片範圍無效"
+    assert layout['video_offset'] + layout['video_size'] <= len(data), "影片超出檔案範圍"
+
+def check_demo_file_structure(data):
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, 'photo.MP.jpg')
+        with open(path, 'wb') as f:
+            f.write(data)
+        with contextlib.redirect_stdout(io.StringIO()):
+            demo_file_structure(path)
+
+TARGETS = {
+    'remove_existing_xmp': check_remove_existing_xmp,
+    'strip_app_segments': check_strip_app_segments,
+    'build_primary_image': check_build_primary_image,
+    'find_xmp_segment': check_find_xmp_segment,
+    'locate_motion_photo_video': check_locate_motion_photo_video,
+    'demo_file_structure': check_demo_file_structure,
+}
+
+def raise_timeout(signum, frame):
+    raise TimeoutError(f"超過 {CALL_TIMEOUT} 秒")
+
+def timed_call(function, data, repeat):
+    """執行並回傳最短時間（秒）；有 SIGALRM 時加上時間上限"""
+    use_alarm = hasattr(signal, 'setitimer')
+    if use_alarm:
+        previous = signal.signal(signal.SIGALRM, raise_timeout)
+    try:
+        best = None
+        for _ in range(repeat):
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, CALL_TIMEOUT)
+            start = time.perf_counter()
+            try:
+                function(data)
+            finally:
+                elapsed = time.perf_counter() - start
+                if use_alarm:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+    finally:
+        if use_alarm:
+            signal.signal(signal.SIGALRM, previous)
+
+def run_case(case_name, target_name, small_size, repeat):
+    """量測小、大兩種輸入，回傳 (小輸入時間, 大輸入時間, 錯誤訊息或 None)"""
+    build = CASES[case_name]
+    check = TARGETS[target_name]
+    try:
+        small_time = timed_call(check, build(small_size), repeat)
+        large_time = timed_call(check, build(small_size * SIZE_FACTOR), repeat)
+    except AssertionError as e:
+        return None, None, f"結果錯誤: {e}"
+    except Exception as e:
+        return None, None, f"{type(e).__name__}: {e}"
+
+    if large_time > NOISE_FLOOR and large_time > small_time * SIZE_FACTOR * SLACK:
+        return small_time, large_time, "超過線性時間"
+    return small_time, large_time, None
+
+def write_corpus(directory, size):
+    """將所有案例輸出為檔案，供外部fuzzer使用"""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for case_name, build in CASES.items():
+        path = directory / f"{case_name}.jpg"
+        path.write_bytes(build(size))
+        print(f"   💾 {path}")
+
+def run_benchmark(cases=None, targets=None, small_size=SMALL_SIZE, repeat=3):
+    """執行所有案例，回傳失敗數"""
+    cases = cases or list(CASES)
+    targets = targets or list(TARGETS)
+    failures = 0
+
+    print(f"🧪 JPEG/XMP 壓力測試: {len(cases)} 個案例 × {len(targets)} 個目標")
+    print(f"   輸入大小 {small_size:,} / {small_size * SIZE_FACTOR:,} bytes, 取 {repeat} 次最佳")
+    print("=" * 78)
+    print(f"{'案例':<20}{'目標':<22}{'小 (ms)':>10}{'大 (ms)':>10}{'倍數':>8}  結果")
+
+    for case_name in cases:
+        for target_name in targets:
+            small_time, large_time, error = run_case(case_name, target_name, small_size, repeat)
+            if small_time is None:
+                timing = f"{'-':>10}{'-':>10}{'-':>8}"
+            else:
+                ratio = large_time / small_time if small_time > 0 else float('inf')
+                timing = f"{small_time * 1000:>10.2f}{large_time * 1000:>10.2f}{ratio:>8.1f}"
+            status = f"❌ {error}" if error else "✅"
+            print(f"{case_name:<20}{target_name:<22}{timing}  {status}")
+            if error:
+                failures += 1
+
+    print("=" * 78)
+    if failures:
+        print(f"⚠️ {failures} 項失敗")
+    else:
+        print("🎉 所有案例都在線性時間內正確完成!")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description='以惡意輸入測試JPEG/XMP處理的正確性與時間複雜度')
+    parser.add_argument('--case', dest='cases', action='append', choices=list(CASES), help='只執行指定案例（可重複）')
+    parser.add_argument('--target', dest='targets', action='append', choices=list(TARGETS), help='只測試指定目標（可重複）')
+    parser.add_argument('--size', type=int, default=SMALL_SIZE, help=f'小輸入大小（預設 {SMALL_SIZE}）')
+    parser.add_argument('--repeat', type=int, default=3, help='每個量測重複次數（預設 3）')
+    parser.add_argument('--corpus', help='將案例輸出到此資料夾後結束')
+    args = parser.parse_args()
+
+    if args.corpus:
+        print(f"📁 輸出測試語料: {args.corpus}")
+        write_corpus(args.corpus, args.size * SIZE_FACTOR)
+        return
+
+    failures = run_benchmark(args.cases, args.targets, args.size, args.repeat)
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+"""
+MotionCraft - Apple Live Photo Converter
+Pair Live Photo stills with their videos and convert them without decoding a cover frame
+配對Apple Live Photo的靜態照片與影片，以原始照片作為封面轉換為Motion Photo（不需解碼影片）
+"""
+
+import io
+import os
+import sys
+import struct
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+
+from backends import probe_video
+from batch import output_path_for
+from main import (
+    XMP_PADDING, build_primary_image, iter_jpeg_segments, replace_atomically, verify_written_output,
+    write_motion_photo,
+)
+from metrics import MetricsSink, stage_timer
+
+STILL_EXTENSIONS = {'.jpg', '.jpeg', '.heic', '.heif'}
+LIVE_VIDEO_EXTENSIONS = {'.mov'}
+
+# 以檔名配對時，兩者都有時區資訊的拍攝時間最多相差的秒數
+CAPTURE_TIME_TOLERANCE = 2.0
+
+# Exif只在JPEG開頭的APP1段，讀取這麼多就足夠
+JPEG_HEADER_LIMIT = 256 * 1024
+
+# moov 通常只有數百KB，超過此大小視為異常
+MOOV_SIZE_LIMIT = 64 * 1024 * 1024
+
+# QuickTime中繼資料鍵
+CONTENT_IDENTIFIER_KEY = 'com.apple.quicktime.content.identifier'
+CREATION_DATE_KEY = 'com.apple.quicktime.creationdate'
+
+# Exif標籤
+EXIF_IFD_POINTER = 0x8769
+DATE_TIME_ORIGINAL = 0x9003
+OFFSET_TIME_ORIGINAL = 0x9011
+MAKER_NOTE = 0x927C
+APPLE_CONTENT_IDENTIFIER = 0x0011
+
+APPLE_MAKER_NOTE = b'Apple iOS\x00'
+
+# QuickTime時間從 1904-01-01 UTC 起算
+QUICKTIME_EPOCH = datetime(1904, 1, 1, tzinfo=timezone.utc)
+
+# Live Photo的靜態照片不在影片開頭，時間戳設為 -1（未指定）
+LIVE_PHOTO_TIMESTAMP_US = -1
+
+def read_ifd(tiff, offset, endian):
+    """讀取一個IFD，回傳 {標籤: 值}；只解碼ASCII和LONG，其他類型回傳 (偏移, 長度)"""
+    entries = {}
+    if offset < 0 or offset + 2 > len(tiff):
+        return entries
+    count = struct.unpack_from(endian + 'H', tiff, offset)[0]
+    for index in range(count):
+        entry = offset + 2 + index * 12
+        if entry + 12 > len(tiff):
+            break
+        tag, kind, length = struct.unpack_from(endian + 'HHI', tiff, entry)
+        if kind == 2:  # ASCII
+            start = entry + 8 if length <= 4 else struct.unpack_from(endian + 'I', tiff, entry + 8)[0]
+            entries[tag] = tiff[start:start + length].split(b'\x00', 1)[0].decode('ascii', 'replace')
+        elif kind == 4:  # LONG
+            entries[tag] = struct.unpack_from(endian + 'I', tiff, entry + 8)[0]
+        else:
+            value_offset = struct.unpack_from(endian + 'I', tiff, entry + 8)[0]
+            entries[tag] = (value_offset, length)
+    return entries
+
+def parse_exif(exif):
+    """從Exif（TIFF，可帶 Exif\\0\\0 前綴）讀取內容識別碼和拍攝時間"""
+    if exif.startswith(b'Exif\x00\x00'):
+        exif = exif[6:]
+    info = {'content_identifier': None, 'capture_time': None}
+    if len(exif) < 8 or exif[:2] not in (b'II', b'MM'):
+        return info
+    endian = '<' if exif[:2] == b'II' else '>'
+
+    ifd0 = read_ifd(exif, struct.unpack_from(endian + 'I', exif, 4)[0], endian)
+    if EXIF_IFD_POINTER not in ifd0:
+        return info
+    exif_ifd = read_ifd(exif, ifd0[EXIF_IFD_POINTER], endian)
+
+    info['capture_time'] = parse_capture_time(exif_ifd.get(DATE_TIME_ORIGINAL), exif_ifd.get(OFFSET_TIME_ORIGINAL))
+
+    # Apple MakerNote: "Apple iOS\0" + 版本(2) + 位元組順序(2)，IFD從第14個位元組開始，偏移相對於MakerNote開頭
+    maker_note = exif_ifd.get(MAKER_NOTE)
+    if isinstance(maker_note, tuple):
+        start, length = maker_note
+        note = exif[start:start + length]
+        if note.startswith(APPLE_MAKER_NOTE) and note[12:14] in (b'II', b'MM'):
+            note_endian = '<' if note[12:14] == b'II' else '>'
+            tags = read_ifd(note, 14, note_endian)
+            identifier = tags.get(APPLE_CONTENT_IDENTIFIER)
+            if isinstance(identifier, str) and identifier:
+                info['content_identifier'] = identifier.upper()
+    return info
+
+def parse_capture_time(value, offset=None):
+    """解析Exif的 'YYYY:MM:DD HH:MM:SS'，有時區偏移時回傳帶時區的時間"""
+    if not value:
+        return None
+    try:
+        capture_time = datetime.strptime(value.strip(), '%Y:%m:%d %H:%M:%S')
+        if offset:
+            capture_time = capture_time.replace(tzinfo=datetime.strptime(offset.strip(), '%z').tzinfo)
+    except ValueError:
+        return None
+    return capture_time
+
+def read_jpeg_exif(path):
+    """讀取JPEG標頭中的Exif段（不讀取影像數據）"""
+    with open(path, 'rb') as f:
+        header = f.read(JPEG_HEADER_LIMIT)
+    if header[:2] != b'\xff\xd8':
+        return None
+    for offset, marker, end in iter_jpeg_segments(header):
+        if marker == 0xE1 and header.startswith(b'Exif\x00\x00', offset + 4, end):
+            return header[offset + 4:end]
+    return None
+
+def read_heic_exif(path):
+    """以 pillow-heif 讀取HEIC的Exif（只解析容器，不解碼影像）；未安裝時回傳 None"""
+    try:
+        import pillow_heif
+    except ImportError:
+        return None
+    heif = pillow_heif.open_heif(path)
+    return heif.info.get('exif')
+
+def read_still_info(path):
+    """讀取靜態照片的內容識別碼和拍攝時間"""
+    if path.suffix.lower() in ('.jpg', '.jpeg'):
+        exif = read_jpeg_exif(path)
+    else:
+        exif = read_heic_exif(path)
+    return parse_exif(exif) if exif else {'content_identifier': None, 'capture_time': None}
+
+def iter_atoms(data, offset=0, end=None):
+    """逐一列出QuickTime atom (類型, 內容開始, 內容結束)"""
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', data, offset)
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                return
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            return
+        yield kind, offset + header, offset + size
+        offset += size
+
+def read_moov(path):
+    """在檔案中跳過 mdat 等大型atom，只讀取 moov"""
+    with open(path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        offset = 0
+        while offset + 8 <= file_size:
+            f.seek(offset)
+            header = f.read(16)
+            size, kind = struct.unpack_from('>I4s', header)
+            header_size = 8
+            if size == 1:
+                if len(header) < 16:
+                    return None
+                size = struct.unpack_from('>Q', header, 8)[0]
+                header_size = 16
+            elif size == 0:
+                size = file_size - offset
+            if size < header_size:
+                return None
+            if kind == b'moov':
+                if size > MOOV_SIZE_LIMIT:
+                    return None
+                f.seek(offset + header_size)
+                return f.read(size - header_size)
+            offset += size
+    return None
+
+def read_quicktime_metadata(moov):
+    """讀取 moov/meta（iPhone）或 moov/udta/meta（ffmpeg）中的 mdta 鍵值（keys + ilst）"""
+    metadata = {}
+    meta_atoms = []
+    for kind, start, end in iter_atoms(moov):
+        if kind == b'meta':
+            meta_atoms.append((start, end))
+        elif kind == b'udta':
+            meta_atoms += [(child_start, child_end) for child, child_start, child_end in iter_atoms(moov, start, end)
+                           if child == b'meta']
+    for start, end in meta_atoms:
+        # QuickTime的 meta 沒有版本/旗標欄位，MP4的有
+        if moov[start:start + 4] == b'\x00\x00\x00\x00':
+            start += 4
+        keys = []
+        values = {}
+        for child, child_start, child_end in iter_atoms(moov, start, end):
+            if child == b'keys' and child_start + 8 <= child_end:
+                count = struct.unpack_from('>I', moov, child_start + 4)[0]
+                position = child_start + 8
+                for _ in range(count):
+                    if position + 8 > child_end:
+                        break
+                    key_size = struct.unpack_from('>I', moov, position)[0]
+                    if key_size < 8:
+                        break
+                    keys.append(moov[position + 8:position + key_size].decode('utf-8', 'replace'))
+                    position += key_size
+            elif child == b'ilst':
+                for item, item_start, item_end in iter_atoms(moov, child_start, child_end):
+                    key_index = struct.unpack('>I', item)[0]
+                    for data_kind, data_start, data_end in iter_atoms(moov, item_start, item_end):
+                        # data atom: 類型(4) + 語系(4) + 值
+                        if data_kind == b'data' and data_start + 8 <= data_end:
+                            values[key_index] = moov[data_start + 8:data_end]
+        for index, key in enumerate(keys, 1):
+            if index in values:
+                metadata[key] = values[index].decode('utf-8', 'replace')
+    return metadata
+
+def read_video_info(path):
+    """讀取Live Photo影片的內容識別碼和拍攝時間"""
+    info = {'content_identifier': None, 'capture_time': None}
+    moov = read_moov(path)
+    if moov is None:
+        return info
+
+    metadata = read_quicktime_metadata(moov)
+    identifier = metadata.get(CONTENT_IDENTIFIER_KEY)
+    if identifier:
+        info['content_identifier'] = identifier.strip().upper()
+
+    creation_date = metadata.get(CREATION_DATE_KEY)
+    if creation_date:
+        try:
+            info['capture_time'] = datetime.strptime(creation_date.strip(), '%Y-%m-%dT%H:%M:%S%z')
+        except ValueError:
+            pass
+    if info['capture_time'] is None:
+        # mvhd 的建立時間為UTC
+        for kind, start, end in iter_atoms(moov):
+            if kind == b'mvhd' and start + 12 <= end:
+                version = moov[start]
+                seconds = struct.unpack_from('>Q' if version == 1 else '>I', moov, start + 4)[0]
+                if seconds:
+                    info['capture_time'] = QUICKTIME_EPOCH + timedelta(seconds=seconds)
+                break
+    return info
+
+def index_directory(directory, recursive=False):
+    """列出資料夾中的靜態照片和影片，並讀取它們的配對資訊
+
+    無法讀取中繼資料的檔案會顯示警告，仍列入結果但沒有配對資訊（只能以檔名配對）。
+    """
+    pattern = '**/*' if recursive else '*'
+    stills = []
+    videos = []
+    for path in sorted(Path(directory).glob(pattern)):
+        if not path.is_file() or path.name.startswith('.'):
+            continue
+        suffix = path.suffix.lower()
+        if suffix in STILL_EXTENSIONS and not path.name.endswith('.MP.jpg'):
+            read_info, entries = read_still_info, stills
+        elif suffix in LIVE_VIDEO_EXTENSIONS:
+            read_info, entries = read_video_info, videos
+        else:
+            continue
+        try:
+            info = read_info(path)
+        except Exception as e:
+            # 截斷或損壞的檔案（包含 pillow-heif 無法開啟的HEIC）不應中斷整個索引
+            print(f"   ⚠️ 無法讀取中繼資料: {path} ({e})")
+            info = {'content_identifier': None, 'capture_time': None}
+        entries.append({'path': path, **info})
+    return stills, videos
+
+def capture_times_match(first, second):
+    """兩者都有時區資訊時比較拍攝時間，否則無法判斷，視為相符"""
+    if first is None or second is None or first.tzinfo is None or second.tzinfo is None:
+        return True
+    return abs((first - second).total_seconds()) <= CAPTURE_TIME_TOLERANCE
+
+def time_distance(first, second):
+    if first is None or second is None or (first.tzinfo is None) != (second.tzinfo is None):
+        return float('inf')
+    return abs((first - second).total_seconds())
+
+def pair_live_photos(stills, videos):
+    """配對靜態照片和影片，回傳 ([(照片, 影片, 配對方式)], 未配對的照片, 未配對的影片)
+
+    先比對內容識別碼，再以同資料夾的相同檔名配對（多個候選時取拍攝時間最接近的）。
+    """
+    pairs = []
+    unpaired_videos = list(videos)
+
+    by_identifier = {}
+    for video in videos:
+        if video['content_identifier']:
+            by_identifier.setdefault(video['content_identifier'], video)
+
+    remaining = []
+    for still in stills:
+        video = by_identifier.pop(still['content_identifier'], None) if still['content_identifier'] else None
+        if video is not None:
+            pairs.append((still, video, 'content identifier'))
+            unpaired_videos.remove(video)
+        else:
+            remaining.append(still)
+
+    by_name = {}
+    for video in unpaired_videos:
+        by_name.setdefault((video['path'].parent, video['path'].stem.lower()), []).append(video)
+
+    unpaired_stills = []
+    for still in remaining:
+        candidates = [video for video in by_name.get((still['path'].parent, still['path'].stem.lower()), [])
+                      if video in unpaired_videos
+                      and capture_times_match(still['capture_time'], video['capture_time'])
+                      # 兩邊都有識別碼但不同時，不是同一張Live Photo
+                      and not (still['content_identifier'] and video['content_identifier'])]
+        if not candidates:
+            unpaired_stills.append(still)
+            continue
+        video = min(candidates, key=lambda video: time_distance(still['capture_time'], video['capture_time']))
+        pairs.append((still, video, 'basename'))
+        unpaired_videos.remove(video)
+
+    return pairs, unpaired_stills, unpaired_videos
+
+def load_still_jpeg(path):
+    """回傳靜態照片的JPEG數據；HEIC需要 pillow-heif 轉換"""
+    if path.suffix.lower() in ('.jpg', '.jpeg'):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    try:
+        import pillow_heif
+    except ImportError:
+        raise RuntimeError("HEIC photos require pillow-heif (pip install pillow-heif)")
+    heif = pillow_heif.open_heif(path)
+    image = heif.to_pillow()
+    # Pillow 不接受 None，只傳入實際存在的Exif和ICC描述檔
+    save_options = {name: heif.info[name] for name in ('exif', 'icc_profile') if heif.info.get(name)}
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=95, **save_options)
+    return output.getvalue()
+
+def remux_to_mp4(video_path, output_path):
+    """將MOV的影片和音訊串流直接複製到MP4容器（不重新編碼），略過Apple的中繼資料軌"""
+    command = ["ffmpeg", "-y", "-i", str(video_path), "-map", "0:v:0", "-map", "0:a:0?",
+               "-c", "copy", "-movflags", "+faststart"]
+    # HEVC以 hvc1 標記寫入MP4，Android和瀏覽器才能播放
+    if probe_video(video_path).get('codec') == 'hevc':
+        command += ["-tag:v", "hvc1"]
+    command.append(str(output_path))
+
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to remux video: {result.stderr.decode()}")
+
+def convert_live_photo(still_path, video_path, output_path, xmp_padding=XMP_PADDING, metrics=None, verify=False):
+    """以原始靜態照片為封面，將Live Photo轉換為Motion Photo"""
+    print(f"🎯 轉換 {still_path} + {video_path} → {output_path}")
+    partial_path = f"{output_path}.partial"
+
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            # 步驟1: 影片直接重新封裝為MP4
+            remuxed_path = os.path.join(work_dir, 'video.mp4')
+            with stage_timer(metrics, 'remux'):
+                remux_to_mp4(video_path, remuxed_path)
+            video_size = os.path.getsize(remuxed_path)
+
+            # 步驟2: 以原始照片為主要圖片並注入XMP
+            with stage_timer(metrics, 'xmp'):
+                primary_image = build_primary_image(load_still_jpeg(Path(still_path)), video_size,
+                                                    LIVE_PHOTO_TIMESTAMP_US, xmp_padding)
+
+            # 步驟3: 合併、驗證（可選）後改名
+            with stage_timer(metrics, 'write'):
+                write_motion_photo(primary_image, remuxed_path, partial_path)
+            if verify:
+                verify_written_output(primary_image, video_size, remuxed_path, partial_path, output_path, metrics)
+            with stage_timer(metrics, 'sync'):
+                replace_atomically(partial_path, output_path)
+
+        print(f"🎉 Motion Photo 已創建: {output_path} "
+              f"(主要圖片 {len(primary_image):,} bytes, 影片 {video_size:,} bytes)")
+        if metrics is not None:
+            output_size = len(primary_image) + video_size
+            metrics.inc('conversions_total', result='success')
+            metrics.inc('bytes_processed_total', os.path.getsize(still_path) + os.path.getsize(video_path),
+                        direction='read')
+            metrics.inc('bytes_processed_total', output_size, direction='written')
+            metrics.observe_size('video', video_size)
+            metrics.observe_size('primary_image', len(primary_image))
+            metrics.observe_size('motion_photo', output_size)
+            metrics.write()
+        return True
+
+    except Exception as e:
+        print(f"❌ 轉換失敗: {e}")
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        if metrics is not None:
+            metrics.inc('conversions_total', result='failure')
+            metrics.write()
+        return False
+
+def convert_directory(directory, output_dir=None, recursive=False, xmp_padding=XMP_PADDING,
+                      metrics=None, verify=False):
+    """配對並轉換資料夾中所有的Live Photo，回傳 (成功數, 失敗數)"""
+    print(f"🔍 索引Live Photo: {directory}")
+    stills, videos = index_directory(directory, recursive)
+    pairs, unpaired_stills, unpaired_videos = pair_live_photos(stills, videos)
+    by_identifier = sum(1 for _, _, method in pairs if method == 'content identifier')
+    print(f"📊 {len(stills)} 張照片, {len(videos)} 個影片 → {len(pairs)} 組配對 "
+          f"({by_identifier} 組以內容識別碼, {len(pairs) - by_identifier} 組以檔名)")
+    for still in unpaired_stills:
+        print(f"   ⚠️ 找不到影片: {still['path']}")
+    for video in unpaired_videos:
+        print(f"   ⚠️ 找不到照片: {video['path']}")
+
+    if output_dir:
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+    succeeded = 0
+    failed = 0
+    owners = {}
+    for index, (still, video, method) in enumerate(pairs, 1):
+        # 與 batch.py 相同：保留照片相對於輸入資料夾的路徑，不同照片不能寫到同一個輸出
+        output_path = output_path_for(still['path'], output_dir, still['path'].relative_to(directory))
+        print(f"\n[{index}/{len(pairs)}] ({method})")
+        owner = owners.setdefault(os.path.abspath(output_path), still['path'])
+        if owner != still['path']:
+            print(f"❌ 輸出 {output_path} 已屬於 {owner}，無法轉換 {still['path']}")
+            failed += 1
+            if metrics is not None:
+                metrics.inc('conversions_total', result='failure')
+                metrics.write()
+            continue
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        if convert_live_photo(still['path'], video['path'], output_path, xmp_padding, metrics, verify):
+            succeeded += 1
+        else:
+            failed += 1
+
+    print("\n" + "=" * 60)
+    print(f"🎉 Live Photo轉換完成: {succeeded} 個成功, {failed} 個失敗")
+    return succeeded, failed
+
+def main():
+    parser = argparse.ArgumentParser(description='配對Apple Live Photo並轉換為Motion Photo（以原始照片為封面）')
+    parser.add_argument('directory', help='包含Live Photo照片和MOV影片的資料夾')
+    parser.add_argument('--output-dir', help='輸出資料夾（預設與照片相同）')
+    parser.add_argument('--recursive', action='store_true', help='遞迴搜尋子資料夾')
+    parser.add_argument('--verify', action='store_true', help='每個轉換寫入後立即驗證')
+    parser.add_argument('--metrics-file', help='將Prometheus指標寫到此檔案，每個工作完成後更新')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        print(f"❌ 找不到資料夾: {args.directory}")
+        sys.exit(1)
+
+    metrics = MetricsSink(args.metrics_file) if args.metrics_file else None
+    _, failed = convert_directory(args.directory, args.output_dir, args.recursive,
+                                  metrics=metrics, verify=args.verify)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
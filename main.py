@@ -6,48 +6,196 @@ Transform videos into Google Motion Photos format with automatic cleanup
 """
 
 import subprocess
+import io
 import os
+import re
 import sys
 import argparse
+import shutil
+import tempfile
+import contextlib
 from pathlib import Path
 from lxml import etree
 
-def extract_frame(video_path, output_path):
-    """從影片提取JPEG封面"""
-    print(f"🎬 從影片提取封面: {video_path}")
-    result = subprocess.run([
-        "ffmpeg", "-y", "-i", video_path,
-        "-ss", "00:00:00.500", "-vframes", "1", output_path
-    ], capture_output=True)
-    if result.returncode != 0:
-        raise RuntimeError(f"Failed to extract frame: {result.stderr.decode()}")
-    print(f"✅ 封面已提取: {output_path}")
+from backends import FRAME_TIMESTAMP, get_backend
+from metrics import MetricsSink, stage_timer
 
-def append_video_to_jpeg(jpeg_path, video_path, output_path):
-    """將影片數據附加到JPEG檔案"""
-    print(f"🔗 合併JPEG和影片數據...")
-    with open(jpeg_path, 'rb') as f_jpeg:
-        jpeg_data = f_jpeg.read()
-    with open(video_path, 'rb') as f_video:
-        video_data = f_video.read()
+# Adobe XMP標識符
+XMP_NAMESPACE = b'http://ns.adobe.com/xap/1.0/\x00'
 
-    with open(output_path, 'wb') as f_out:
-        f_out.write(jpeg_data)
-        f_out.write(video_data)
+# Motion Photo XMP使用的命名空間
+RDF_NS = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+CONTAINER_NS = "http://ns.google.com/photos/1.0/container/"
+CAMERA_NS = "http://ns.google.com/photos/1.0/camera/"
+
+# 寫入驗證時比對的影片開頭長度
+VIDEO_PROBE_SIZE = 16
+
+# XMP中的長度與偏移（元素或屬性形式皆可）
+CONTAINER_LENGTH = re.compile(r'(?:Item|Container):Length(?:="(\d+)"|>(\d+)<)')
+MICRO_VIDEO_OFFSET = re.compile(r'MicroVideoOffset(?:="(\d+)"|>(\d+)<)')
+PRESENTATION_TIMESTAMP = re.compile(r'MotionPhotoPresentationTimestampUs(?:="(-?\d+)"|>(-?\d+)<)')
+
+# Container:Directory中的項目（屬性形式自行結束，元素形式到結束標籤為止）
+CONTAINER_ITEM = re.compile(r'<Container:Item\b[^>]*?(?:/>|>.*?</Container:Item>)', re.DOTALL)
+CONTAINER_SEMANTIC = re.compile(r'(?:Item|Container):Semantic(?:="([^"]*)"|>([^<]*)<)')
+
+# XMP封包結尾（前面的空白為填充）
+XPACKET_TAIL = re.compile(rb'\s*(<\?xpacket end=[^>]*\?>)\s*$')
+
+# 內嵌影片開頭可能出現的 ISO BMFF / QuickTime atom
+VIDEO_BOX_TYPES = {b'ftyp', b'moov', b'mdat', b'wide', b'free', b'skip'}
+
+# 廠商格式的掃描範圍（尾端的Samsung SEF目錄、主要JPEG之後的影片標記）
+TAIL_SCAN_SIZE = 64 * 1024
+SAMSUNG_VIDEO_MARKER = b'MotionPhoto_Data'
+
+# locate_motion_photo_video() 回傳的格式名稱
+LAYOUT_NAMES = {
+    'container': 'Motion Photo (Container XMP)',
+    'microvideo': '舊版 MicroVideo (MicroVideoOffset)',
+    'samsung': 'Samsung (MotionPhoto_Data)',
+}
+
+# 預留的XMP空白填充大小，讓之後的元數據更新可以就地寫入
+XMP_PADDING = 2048
+
+# 標準輸入小於此大小時保留在記憶體，超過才寫到暫存檔
+STDIN_SPOOL_LIMIT = 64 * 1024 * 1024
+
+# 重新編碼封面時未指定品質所使用的JPEG品質
+COVER_QUALITY = 85
 
-    print(f"✅ 檔案合併完成: {len(video_data):,} bytes 影片數據")
-    return len(jpeg_data)
+# 精簡封面時保留的APP段：APP0 (JFIF)、APP2 (ICC色彩描述檔)、APP14 (Adobe色彩轉換)
+KEEP_APP_MARKERS = {0xE0, 0xE2, 0xEE}
 
-# 舊的 generate_xmp() 函數已移除，請使用 generate_xmp_with_size() 代替
+# 標記前的連續填充字節
+FILL_BYTES = re.compile(rb'\xff+')
 
-def generate_xmp_with_size(primary_image_size, video_path):
-    """使用指定的主要圖片大小生成XMP元數據"""
-    video_size = os.path.getsize(video_path)
+# 視為影片的副檔名
+VIDEO_EXTENSIONS = {'.mp4', '.mov', '.m4v', '.avi', '.mkv', '.wmv', '.3gp'}
+
+# 在檔案內搬移影片數據時的區塊大小
+COPY_CHUNK_SIZE = 1024 * 1024
+
+def extract_frame(video_path, output_path, thumbnails=None, backend=None, high_quality=False):
+    """從影片提取JPEG封面，可在同一次解碼中輸出多個縮圖
+
+    thumbnails 為 {最長邊像素: 輸出路徑}，回傳相同結構的字典。
+    backend 為 'ffmpeg'、'pyav' 或 None（自動選擇最快的可用後端）。
+    high_quality 以最高品質輸出封面，供之後重新編碼使用。
+    """
+    backend = get_backend(backend)
+    source = video_path if isinstance(video_path, (str, os.PathLike)) else "標準輸入"
+    print(f"🎬 從影片提取封面: {source} [{backend.name}]")
+    backend.extract_frame(video_path, output_path, thumbnails, high_quality)
+    print(f"✅ 封面已提取: {output_path}")
+    for size, path in (thumbnails or {}).items():
+        print(f"✅ {size}px 縮圖已提取: {path}")
+    return dict(thumbnails or {})
+
+def strip_app_segments(jpeg_data):
+    """移除封面中不需要的APP段和註解段（保留JFIF、ICC和Adobe段）"""
+    if jpeg_data[:2] != b'\xff\xd8':
+        raise ValueError("Invalid JPEG file")
     
+    parts = []
+    kept_from = 0
+    for offset, marker, segment_end in iter_jpeg_segments(jpeg_data):
+        if marker == 0xFE:  # COM
+            unneeded = True
+        elif marker == 0xE2:
+            unneeded = not jpeg_data.startswith(b'ICC_PROFILE\x00', offset + 4, segment_end)
+        else:
+            unneeded = 0xE0 <= marker <= 0xEF and marker not in KEEP_APP_MARKERS
+        
+        if unneeded:
+            parts.append(jpeg_data[kept_from:offset])
+            kept_from = segment_end
+    
+    parts.append(jpeg_data[kept_from:])
+    return b''.join(parts)
+
+def cover_reencodes(cover_options):
+    """cover_options 是否會讓 encode_cover() 重新編碼像素（只有 strip 時僅移除APP段）"""
+    if not cover_options:
+        return False
+    return (cover_options.get('quality') is not None or cover_options.get('optimize')
+            or cover_options.get('progressive') or cover_options.get('subsampling') is not None
+            or cover_options.get('max_size') is not None)
+
+def encode_cover(jpeg_data, quality=None, optimize=False, progressive=False,
+                 subsampling=None, max_size=None, strip=False):
+    """在記憶體中重新編碼封面JPEG以縮小主要圖片
+
+    quality 為JPEG品質 (1-95)，subsampling 為 '4:4:4'、'4:2:2' 或 '4:2:0'，
+    max_size 為 (最大寬, 最大高)，strip 移除不需要的APP段。
+    """
+    if not cover_reencodes({'quality': quality, 'optimize': optimize, 'progressive': progressive,
+                            'subsampling': subsampling, 'max_size': max_size}):
+        return strip_app_segments(jpeg_data) if strip else jpeg_data
+    
+    from PIL import Image
+    
+    with Image.open(io.BytesIO(jpeg_data)) as image:
+        image.load()
+        info = image.info
+        if max_size is not None:
+            image.thumbnail(max_size, Image.LANCZOS)
+        if image.mode not in ('RGB', 'L', 'CMYK'):
+            image = image.convert('RGB')
+        
+        save_options = {
+            'quality': quality if quality is not None else COVER_QUALITY,
+            'optimize': optimize,
+            'progressive': progressive,
+        }
+        if subsampling is not None:
+            save_options['subsampling'] = subsampling
+        if not strip:
+            for key in ('icc_profile', 'exif'):
+                if info.get(key):
+                    save_options[key] = info[key]
+        
+        output = io.BytesIO()
+        image.save(output, 'JPEG', **save_options)
+    
+    encoded = output.getvalue()
+    return strip_app_segments(encoded) if strip else encoded
+
+def thumbnail_path(output_path, size):
+    """根據Motion Photo輸出路徑生成縮圖路徑 (video.MP.jpg → video.256.jpg)"""
+    output_path = Path(output_path)
+    name = output_path.name
+    if name.endswith('.MP.jpg'):
+        name = name[:-len('.MP.jpg')]
+    else:
+        name = output_path.stem
+    return output_path.with_name(f"{name}.{size}.jpg")
+
+def write_motion_photo(primary_image, video_path, output_path):
+    """寫出主要圖片，並分塊附加影片數據"""
+    with open(output_path, 'wb') as f_out:
+        f_out.write(primary_image)
+        with open(video_path, 'rb') as f_video:
+            while True:
+                chunk = f_video.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                f_out.write(chunk)
+
+def replace_atomically(partial_path, output_path):
+    """將寫入完成的暫存檔同步到磁碟後，原子地改名為正式輸出"""
+    with open(partial_path, 'r+b') as f:
+        os.fsync(f.fileno())
+    os.replace(partial_path, output_path)
+
+def generate_xmp_with_lengths(primary_image_size, video_size, presentation_timestamp_us=0):
+    """使用指定的主要圖片大小和影片大小生成XMP元數據"""
     # 使用與正常Motion Photos相同的命名空間結構
-    rdf_ns = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
-    container_ns = "http://ns.google.com/photos/1.0/container/"
-    camera_ns = "http://ns.google.com/photos/1.0/camera/"
+    rdf_ns = RDF_NS
+    container_ns = CONTAINER_NS
+    camera_ns = CAMERA_NS
 
     NSMAP = {
         "rdf": rdf_ns,
@@ -63,7 +211,7 @@ def generate_xmp_with_size(primary_image_size, video_path):
     # Camera metadata - 使用Camera命名空間
     etree.SubElement(desc, f"{{{camera_ns}}}MotionPhoto").text = "1"
     etree.SubElement(desc, f"{{{camera_ns}}}MotionPhotoVersion").text = "1"
-    etree.SubElement(desc, f"{{{camera_ns}}}MotionPhotoPresentationTimestampUs").text = "0"
+    etree.SubElement(desc, f"{{{camera_ns}}}MotionPhotoPresentationTimestampUs").text = str(presentation_timestamp_us)
 
     # Container directory
     container_dir = etree.SubElement(desc, f"{{{container_ns}}}Directory")
@@ -85,111 +233,567 @@ def generate_xmp_with_size(primary_image_size, video_path):
 
     return etree.tostring(rdf, pretty_print=True, xml_declaration=False, encoding='utf-8')
 
-def inject_xmp_metadata(jpeg_path, xmp_content):
-    """將XMP元數據注入JPEG檔案"""
-    print(f"📝 注入XMP元數據...")
-    
-    with open(jpeg_path, 'rb') as f:
-        jpeg_data = f.read()
-    
-    if jpeg_data[:2] != b'\xff\xd8':
-        raise ValueError("Invalid JPEG file")
-    
-    # 先移除現有的XMP段（如果有的話）
-    cleaned_jpeg = remove_existing_xmp(jpeg_data)
-    
-    # 創建XMP包 - 與正常Motion Photos格式相同
-    xmp_packet = f'''<?xpacket begin="" id="W5M0MpCehiHzreSzNTczkc9d"?>
+def make_xmp_padding(size):
+    """生成XMP封包的空白填充（每100字節換行）"""
+    full_lines, rest = divmod(size, 100)
+    return (b' ' * 99 + b'\n') * full_lines + b' ' * rest
+
+def build_xmp_segment(xmp_content, padding=0, segment_size=None):
+    """建構包含XMP封包的APP1段，可指定空白填充或固定的段大小"""
+    packet_head = f'''<?xpacket begin="" id="W5M0MpCehiHzreSzNTczkc9d"?>
 {xmp_content.decode('utf-8').strip()}
-<?xpacket end="w"?>'''.encode('utf-8')
+'''.encode('utf-8')
+    packet_tail = b'<?xpacket end="w"?>'
+    
+    # 段大小 = 標記(2) + 長度欄位(2) + 標識符 + 封包
+    base_size = 4 + len(XMP_NAMESPACE) + len(packet_head) + len(packet_tail)
+    if segment_size is not None:
+        padding = segment_size - base_size
+        if padding < 0:
+            raise ValueError("XMP data does not fit in segment")
     
-    # Adobe XMP標識符
-    adobe_xmp_ns = b'http://ns.adobe.com/xap/1.0/\x00'
+    xmp_packet = packet_head + make_xmp_padding(padding) + packet_tail
     
     # 構建XMP段
-    xmp_length = len(xmp_packet) + len(adobe_xmp_ns) + 2
+    xmp_length = len(xmp_packet) + len(XMP_NAMESPACE) + 2
     if xmp_length > 65535:
         raise ValueError("XMP data too large")
     
-    xmp_segment = b'\xff\xe1' + xmp_length.to_bytes(2, 'big') + adobe_xmp_ns + xmp_packet
+    return b'\xff\xe1' + xmp_length.to_bytes(2, 'big') + XMP_NAMESPACE + xmp_packet
+
+def build_primary_image(jpeg_data, video_size, presentation_timestamp_us=0, padding=XMP_PADDING):
+    """在記憶體中組合含XMP的主要圖片，Container長度與最終大小一致"""
+    if jpeg_data[:2] != b'\xff\xd8':
+        raise ValueError("Invalid JPEG file")
     
-    # 插入XMP段到JPEG開頭
-    new_jpeg = cleaned_jpeg[:2] + xmp_segment + cleaned_jpeg[2:]
+    cleaned_jpeg = remove_existing_xmp(jpeg_data)
     
-    with open(jpeg_path, 'wb') as f:
-        f.write(new_jpeg)
+    # XMP中的長度會影響XMP本身的大小，重複計算直到穩定
+    primary_image_size = len(cleaned_jpeg)
+    while True:
+        xmp_content = generate_xmp_with_lengths(primary_image_size, video_size, presentation_timestamp_us)
+        xmp_segment = build_xmp_segment(xmp_content, padding)
+        if len(cleaned_jpeg) + len(xmp_segment) == primary_image_size:
+            break
+        primary_image_size = len(cleaned_jpeg) + len(xmp_segment)
     
-    print(f"✅ XMP元數據已注入")
+    return cleaned_jpeg[:2] + xmp_segment + cleaned_jpeg[2:]
+
+def iter_jpeg_segments(jpeg_data):
+    """逐一列出JPEG標頭中的標記段 (偏移, 標記, 段結束)，遇到SOS或無法解析的段時停止
+
+    只往前掃描、不回頭，處理時間與資料長度成線性關係。
+    """
+    i = 2
+    length_limit = len(jpeg_data)
+    while i + 1 < length_limit:
+        if jpeg_data[i] != 0xFF:
+            # 跳過段之間的雜散字節
+            i = jpeg_data.find(b'\xff', i)
+            if i < 0:
+                return
+            continue
+        
+        marker = jpeg_data[i + 1]
+        if marker == 0xFF:  # 填充字節，一次跳過整段連續的0xFF
+            i = FILL_BYTES.match(jpeg_data, i).end() - 1
+            continue
+        if marker in (0xDA, 0xD9):  # SOS/EOI，標頭結束
+            return
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:  # 沒有長度欄位的標記
+            yield i, marker, i + 2
+            i += 2
+            continue
+        
+        if i + 4 > length_limit:
+            return
+        segment_end = i + 2 + int.from_bytes(jpeg_data[i + 2:i + 4], 'big')
+        if segment_end < i + 4 or segment_end > length_limit:
+            return
+        yield i, marker, segment_end
+        i = segment_end
 
 def remove_existing_xmp(jpeg_data):
     """移除JPEG中現有的XMP段"""
     if len(jpeg_data) < 4:
         return jpeg_data
     
-    result = jpeg_data[:2]  # 保留JPEG標頭
-    i = 2
+    parts = []
+    kept_from = 0
+    for offset, marker, segment_end in iter_jpeg_segments(jpeg_data):
+        # APP1 段且以Adobe XMP標識符開頭才是XMP段
+        if marker == 0xE1 and jpeg_data.startswith(XMP_NAMESPACE, offset + 4, segment_end):
+            parts.append(jpeg_data[kept_from:offset])
+            kept_from = segment_end
+    
+    parts.append(jpeg_data[kept_from:])
+    return b''.join(parts)
+
+def find_xmp_segment(f):
+    """在JPEG標頭中尋找XMP段，回傳 (段偏移, 段大小, XMP內容) 或 None"""
+    f.seek(0)
+    if f.read(2) != b'\xff\xd8':
+        raise ValueError("Invalid JPEG file")
+    
+    offset = 2
+    while True:
+        f.seek(offset)
+        header = f.read(4)
+        if len(header) < 4 or header[0] != 0xFF:
+            return None
+        if header[1] == 0xFF:  # 填充字節，以區塊讀取跳過整段連續的0xFF
+            f.seek(offset + 1)
+            chunk = f.read(4096)
+            # 移到連續0xFF中的最後一個，它才是標記的開頭
+            offset += FILL_BYTES.match(chunk).end()
+            continue
+        if header[1] in (0xDA, 0xD9):  # SOS/EOI，標頭結束
+            return None
+        
+        length = int.from_bytes(header[2:4], 'big')
+        if length < 2:
+            return None
+        
+        if header[1] == 0xE1:
+            segment_data = f.read(length - 2)
+            if len(segment_data) < length - 2:  # 段被截斷
+                return None
+            if segment_data.startswith(XMP_NAMESPACE):
+                return offset, length + 2, segment_data[len(XMP_NAMESPACE):]
+        
+        offset += 2 + length
+
+def find_jpeg_end(f):
+    """回傳主要JPEG的EOI之後的偏移，找不到時回傳 None
+
+    標頭段依長度跳過（Exif縮圖有自己的EOI）；壓縮數據中的0xFF都會被填充，SOS之後第一個 FFD9 就是EOI。
+    """
+    f.seek(0)
+    if f.read(2) != b'\xff\xd8':
+        return None
+    
+    offset = 2
+    while True:
+        f.seek(offset)
+        header = f.read(4)
+        if len(header) < 4 or header[0] != 0xFF:
+            return None
+        if header[1] == 0xFF:
+            offset += 1
+            continue
+        if header[1] == 0xD9:
+            return offset + 2
+        if header[1] == 0xDA:
+            break
+        length = int.from_bytes(header[2:4], 'big')
+        if length < 2:
+            return None
+        offset += 2 + length
     
-    while i < len(jpeg_data) - 1:
-        if jpeg_data[i] == 0xFF:
-            marker = jpeg_data[i + 1]
+    # 區塊之間重疊一個字節，避免 FF 和 D9 被切開
+    f.seek(offset)
+    position = offset
+    previous = b''
+    while True:
+        chunk = f.read(COPY_CHUNK_SIZE)
+        if not chunk:
+            return None
+        data = previous + chunk
+        eoi = data.find(b'\xff\xd9')
+        if eoi >= 0:
+            return position - len(previous) + eoi + 2
+        position += len(chunk)
+        previous = chunk[-1:]
+
+def xmp_integers(pattern, xmp_content):
+    """列出XMP中符合 pattern 的整數值（依出現順序）"""
+    return [int(attribute or element) for attribute, element in pattern.findall(xmp_content)]
+
+def is_video_box(f, offset):
+    """偏移處是否為影片容器的atom開頭（一次8字節的讀取）"""
+    f.seek(offset)
+    header = f.read(8)
+    return len(header) == 8 and header[4:8] in VIDEO_BOX_TYPES
+
+def locate_samsung_video(f, file_size):
+    """從檔案尾端的SEF目錄（或主要JPEG之後的 MotionPhoto_Data 標記）找出影片，回傳 (偏移, 長度) 或 None
+
+    SEF尾端: ... SEFH目錄 + 目錄長度(4, little-endian) + 'SEFT'；目錄中每個項目記錄數據區塊
+    與目錄開頭的距離和長度，數據區塊以 類型(4) + 名稱長度(4) + 名稱 開頭。
+    """
+    window_start = max(file_size - TAIL_SCAN_SIZE, 0)
+    f.seek(window_start)
+    tail = f.read()
+    video_end = len(tail)
+    
+    trailer = tail.rfind(b'SEFT')
+    if trailer >= 4:
+        directory = trailer - 4 - int.from_bytes(tail[trailer - 4:trailer], 'little')
+        if directory >= 0 and tail.startswith(b'SEFH', directory):
+            video_end = directory
+            count = int.from_bytes(tail[directory + 8:directory + 12], 'little')
+            for index in range(count):
+                entry = directory + 12 + index * 12
+                if entry + 12 > trailer - 4:
+                    break
+                distance = int.from_bytes(tail[entry + 4:entry + 8], 'little')
+                size = int.from_bytes(tail[entry + 8:entry + 12], 'little')
+                data_offset = window_start + directory - distance
+                if data_offset < 0:
+                    continue
+                f.seek(data_offset)
+                header = f.read(8 + len(SAMSUNG_VIDEO_MARKER))
+                name_length = int.from_bytes(header[4:8], 'little')
+                if name_length == len(SAMSUNG_VIDEO_MARKER) and header[8:] == SAMSUNG_VIDEO_MARKER:
+                    video_offset = data_offset + 8 + name_length
+                    return video_offset, size - 8 - name_length
+    
+    # 沒有SEF目錄時，標記在影片之前：在主要JPEG結束後的有限範圍內尋找（影片緊接在標記之後）
+    jpeg_end = find_jpeg_end(f)
+    if jpeg_end is None:
+        return None
+    f.seek(jpeg_end)
+    marker = f.read(TAIL_SCAN_SIZE).find(SAMSUNG_VIDEO_MARKER)
+    if marker < 0:
+        return None
+    video_offset = jpeg_end + marker + len(SAMSUNG_VIDEO_MARKER)
+    video_end = window_start + video_end
+    if video_offset >= video_end:
+        return None
+    return video_offset, video_end - video_offset
+
+def locate_motion_photo_video(f):
+    """依序以 Container XMP、MicroVideoOffset、尾端廠商標記找出內嵌影片
+
+    回傳 {'layout', 'video_offset', 'video_size', 'file_size'}，只需要讀取標頭、尾端和影片開頭的少量數據。
+    Container長度所指的位置不是影片容器時（例如尾端還有廠商數據），會繼續嘗試其他方式。
+    """
+    f.seek(0, 2)
+    file_size = f.tell()
+    candidates = []
+    
+    found = find_xmp_segment(f)
+    if found is not None:
+        xmp_content = found[2].decode('utf-8', 'replace')
+        lengths = xmp_integers(CONTAINER_LENGTH, xmp_content)
+        if lengths and 0 < lengths[-1] <= file_size:
+            candidates.append(('container', file_size - lengths[-1], lengths[-1]))
+        # 舊版格式: MicroVideoOffset 是影片開頭到檔案結尾的距離
+        offsets = xmp_integers(MICRO_VIDEO_OFFSET, xmp_content)
+        if offsets and 0 < offsets[0] <= file_size:
+            candidates.append(('microvideo', file_size - offsets[0], offsets[0]))
+    
+    for layout, video_offset, video_size in candidates:
+        if is_video_box(f, video_offset):
+            return {'layout': layout, 'video_offset': video_offset, 'video_size': video_size, 'file_size': file_size}
+    
+    samsung = locate_samsung_video(f, file_size)
+    if samsung is not None and samsung[1] > 0 and is_video_box(f, samsung[0]):
+        return {'layout': 'samsung', 'video_offset': samsung[0], 'video_size': samsung[1], 'file_size': file_size}
+    
+    # 無法確認容器格式的影片（例如 .mkv 來源），仍以 XMP 記錄的位置為準
+    if candidates:
+        layout, video_offset, video_size = candidates[0]
+        return {'layout': layout, 'video_offset': video_offset, 'video_size': video_size, 'file_size': file_size}
+    raise ValueError("找不到內嵌影片")
+
+def read_motion_photo_layout(f):
+    """從Motion Photo的XMP讀取XMP段位置、影片偏移和大小"""
+    found = find_xmp_segment(f)
+    if found is None:
+        raise ValueError("找不到XMP元數據")
+    xmp_offset, xmp_size, xmp_data = found
+    xmp_content = xmp_data.decode('utf-8', 'replace')
+    
+    length_matches = xmp_integers(CONTAINER_LENGTH, xmp_content)
+    if not length_matches or not length_matches[-1]:
+        raise ValueError("找不到Container:Length信息")
+    
+    timestamp_matches = xmp_integers(PRESENTATION_TIMESTAMP, xmp_content)
+    
+    f.seek(0, 2)
+    file_size = f.tell()
+    video_size = length_matches[-1]  # 最後一個是MotionPhoto影片
+    if video_size > file_size:
+        raise ValueError("Container:Length超出檔案大小")
+    
+    return {
+        'xmp_offset': xmp_offset,
+        'xmp_size': xmp_size,
+        'video_offset': file_size - video_size,  # 影片位於檔案末尾
+        'video_size': video_size,
+        'presentation_timestamp_us': timestamp_matches[0] if timestamp_matches else 0,
+        'file_size': file_size,
+        'xmp_packet': xmp_data,
+    }
+
+def container_items(xmp_content):
+    """列出Container:Directory的項目 [{'semantic', 'length', 'length_span'}]，length_span 為數值在XMP中的位置"""
+    items = []
+    for item in CONTAINER_ITEM.finditer(xmp_content):
+        semantic = CONTAINER_SEMANTIC.search(item.group())
+        length = CONTAINER_LENGTH.search(item.group())
+        entry = {
+            'semantic': (semantic.group(1) or semantic.group(2)) if semantic else None,
+            'length': None,
+            'length_span': None,
+        }
+        if length:
+            group = 1 if length.group(1) is not None else 2
+            entry['length'] = int(length.group(group))
+            entry['length_span'] = (item.start() + length.start(group), item.start() + length.end(group))
+        items.append(entry)
+    return items
+
+def replace_span(text, span, value):
+    return text[:span[0]] + str(value) + text[span[1]:]
+
+def set_presentation_timestamp(xmp_content, presentation_timestamp_us):
+    """只修改XMP中的MotionPhotoPresentationTimestampUs值，其他內容不變"""
+    match = PRESENTATION_TIMESTAMP.search(xmp_content)
+    if match is None:
+        raise ValueError("找不到MotionPhotoPresentationTimestampUs")
+    group = 1 if match.group(1) is not None else 2
+    return replace_span(xmp_content, match.span(group), presentation_timestamp_us)
+
+def repack_xmp_segment(xmp_packet, padding=0, segment_size=None):
+    """以新的空白填充重新組合現有的XMP封包（內容不變），可指定固定的段大小"""
+    tail = XPACKET_TAIL.search(xmp_packet)
+    if tail is None:
+        # 沒有 xpacket 結尾就無法調整填充，只能原樣寫回
+        body, packet_tail, padding = xmp_packet, b'', 0
+        base_size = 4 + len(XMP_NAMESPACE) + len(body)
+        if segment_size is not None and segment_size != base_size:
+            raise ValueError("XMP data does not fit in segment")
+    else:
+        body, packet_tail = xmp_packet[:tail.start()] + b'\n', tail.group(1)
+        base_size = 4 + len(XMP_NAMESPACE) + len(body) + len(packet_tail)
+        if segment_size is not None:
+            padding = segment_size - base_size
+            if padding < 0:
+                raise ValueError("XMP data does not fit in segment")
+    
+    xmp_length = base_size - 2 + padding
+    if xmp_length > 65535:
+        raise ValueError("XMP data too large")
+    return b'\xff\xe1' + xmp_length.to_bytes(2, 'big') + XMP_NAMESPACE + body + make_xmp_padding(padding) + packet_tail
+
+def shift_video_payload(f, video_offset, video_size, new_offset):
+    """在檔案內將影片數據搬移到新的偏移位置"""
+    if new_offset > video_offset:
+        # 往後搬移：從尾端開始複製，避免覆蓋尚未搬移的數據
+        position = video_size
+        while position > 0:
+            chunk_size = min(COPY_CHUNK_SIZE, position)
+            position -= chunk_size
+            f.seek(video_offset + position)
+            chunk = f.read(chunk_size)
+            f.seek(new_offset + position)
+            f.write(chunk)
+    elif new_offset < video_offset:
+        # 往前搬移：從開頭開始複製，最後截斷多餘的尾端
+        position = 0
+        while position < video_size:
+            chunk_size = min(COPY_CHUNK_SIZE, video_size - position)
+            f.seek(video_offset + position)
+            chunk = f.read(chunk_size)
+            f.seek(new_offset + position)
+            f.write(chunk)
+            position += chunk_size
+        f.truncate(new_offset + video_size)
+
+def update_motion_photo(photo_path, presentation_timestamp_us=None, cover_path=None, xmp_padding=XMP_PADDING):
+    """就地更新Motion Photo的元數據或封面，不重寫影片數據
+
+    只修改現有XMP封包中的時間戳和Primary長度，其他屬性和Container項目保持不變。
+    更換封面只支援 Primary + MotionPhoto 兩個項目的格式（本工具輸出的格式）。
+    """
+    print(f"✏️ 更新 {photo_path}")
+    
+    try:
+        cover_data = None
+        if cover_path is not None:
+            with open(cover_path, 'rb') as f_cover:
+                cover_data = f_cover.read()
+            if cover_data[:2] != b'\xff\xd8':
+                raise ValueError("Invalid JPEG file")
+        
+        with open(photo_path, 'r+b') as f:
+            layout = read_motion_photo_layout(f)
+            video_offset = layout['video_offset']
+            video_size = layout['video_size']
+            xmp_offset = layout['xmp_offset']
+            xmp_size = layout['xmp_size']
+            xmp_content = layout['xmp_packet'].decode('utf-8')
+            if presentation_timestamp_us is not None:
+                xmp_content = set_presentation_timestamp(xmp_content, presentation_timestamp_us)
+            items = container_items(xmp_content)
+            
+            if cover_data is not None and [item['semantic'] for item in items] != ['Primary', 'MotionPhoto']:
+                # 其他項目（例如GainMap）屬於原本的封面，不能沿用到新封面
+                raise ValueError("只能更換 Primary + MotionPhoto 兩個項目的Motion Photo封面")
             
-            if marker == 0xE1:  # APP1 段（可能包含XMP）
-                if i + 4 < len(jpeg_data):
-                    length = int.from_bytes(jpeg_data[i + 2:i + 4], 'big')
-                    segment_end = i + 2 + length
-                    
-                    # 檢查是否為XMP段
-                    if segment_end <= len(jpeg_data):
-                        segment_data = jpeg_data[i + 4:segment_end]
-                        if segment_data.startswith(b'http://ns.adobe.com/xap/1.0/\x00'):
-                            # 跳過XMP段
-                            i = segment_end
-                            continue
+            if cover_data is None:
+                # 只更新元數據：封包若能放進原有的段（含填充）就直接覆寫
+                try:
+                    xmp_segment = repack_xmp_segment(xmp_content.encode('utf-8'), segment_size=xmp_size)
+                except ValueError:
+                    xmp_segment = None
                 
-                # 不是XMP段，保留
-                if i + 4 < len(jpeg_data):
-                    length = int.from_bytes(jpeg_data[i + 2:i + 4], 'big')
-                    segment_end = i + 2 + length
-                    if segment_end <= len(jpeg_data):
-                        result += jpeg_data[i:segment_end]
-                        i = segment_end
-                    else:
-                        result += jpeg_data[i:]
-                        break
-                else:
-                    result += jpeg_data[i:]
-                    break
+                if xmp_segment is not None:
+                    f.seek(xmp_offset)
+                    f.write(xmp_segment)
+                    print(f"✅ 已就地寫入 {len(xmp_segment):,} bytes XMP元數據")
+                    return True
+                
+                # 放不下時擴大XMP段，Primary（含XMP）隨之變大，其後的項目不變
+                f.seek(0)
+                header = f.read(video_offset)
+                before, after = header[:xmp_offset], header[xmp_offset + xmp_size:]
+            else:
+                cleaned_cover = remove_existing_xmp(cover_data)
+                before, after = cleaned_cover[:2], cleaned_cover[2:]
             
-            elif marker in [0xE0, 0xE2, 0xE3, 0xE4, 0xE5, 0xE6, 0xE7, 0xE8, 0xE9, 0xEA, 0xEB, 0xEC, 0xED, 0xEE, 0xEF]:
-                # 其他APP段
-                if i + 4 < len(jpeg_data):
-                    length = int.from_bytes(jpeg_data[i + 2:i + 4], 'big')
-                    segment_end = i + 2 + length
-                    if segment_end <= len(jpeg_data):
-                        result += jpeg_data[i:segment_end]
-                        i = segment_end
-                    else:
-                        result += jpeg_data[i:]
-                        break
-                else:
-                    result += jpeg_data[i:]
-                    break
+            primary = items[0] if items and items[0]['semantic'] == 'Primary' and items[0]['length'] else None
             
-            elif marker == 0xDA:  # SOS段，圖像數據開始
-                result += jpeg_data[i:]
-                break
+            def primary_length(header_size):
+                # 換封面時Primary就是整個標頭；擴大XMP時Primary增加的大小等於標頭增加的大小
+                return header_size if cover_data is not None else primary['length'] + header_size - video_offset
             
-            else:
-                result += jpeg_data[i:i + 2]
-                i += 2
-        else:
-            result += jpeg_data[i:i + 1]
-            i += 1
+            def with_primary_length(header_size):
+                if primary is None:
+                    return xmp_content.encode('utf-8')
+                return replace_span(xmp_content, primary['length_span'], primary_length(header_size)).encode('utf-8')
+            
+            # 新的標頭若能用XMP填充補齊到原本的大小，影片位置不變
+            try:
+                xmp_segment = repack_xmp_segment(with_primary_length(video_offset),
+                                                 segment_size=video_offset - len(before) - len(after))
+            except ValueError:
+                # XMP中的長度會影響XMP本身的大小，重複計算直到穩定
+                header_size = len(before) + len(after)
+                while True:
+                    xmp_segment = repack_xmp_segment(with_primary_length(header_size), xmp_padding)
+                    if len(before) + len(xmp_segment) + len(after) == header_size:
+                        break
+                    header_size = len(before) + len(xmp_segment) + len(after)
+                print(f"🔀 移動影片數據: {video_offset:,} → {header_size:,}")
+                shift_video_payload(f, video_offset, video_size, header_size)
+            
+            f.seek(0)
+            f.write(before + xmp_segment + after)
+            print(f"✅ 已寫入 {len(before) + len(xmp_segment) + len(after):,} bytes 標頭區域")
+        
+        return True
     
-    return result
+    except Exception as e:
+        print(f"❌ 更新失敗: {e}")
+        return False
+
+def prepare_primary_image(video_path, cover_path, thumbnails=None, backend=None, cover_options=None,
+                          xmp_padding=XMP_PADDING, metrics=None):
+    """提取封面、重新編碼並注入XMP，回傳記憶體中的 (主要圖片, 影片大小)
 
-def convert_to_motion_photo(video_path, output_path=None):
-    """轉換影片為Motion Photo"""
+    video_path 可以是路徑或可 seek 的檔案物件（需要後端支援）。
+    cover_path 為封面的臨時檔案，由呼叫者負責清理。
+    metrics 為 MetricsSink 時記錄各步驟的耗時。
+    """
+    # 步驟1: 提取封面（縮圖在同一次解碼中產生）
+    with stage_timer(metrics, 'extract'):
+        # 只有會重新編碼時才需要最高品質的封面，否則它就是最終的主要圖片
+        extract_frame(video_path, cover_path, thumbnails, backend, high_quality=cover_reencodes(cover_options))
+    with open(cover_path, 'rb') as f_cover:
+        cover_data = f_cover.read()
+    
+    # 步驟2: 在記憶體中重新編碼封面（可選）
+    if cover_options:
+        with stage_timer(metrics, 'encode'):
+            encoded_cover = encode_cover(cover_data, **cover_options)
+        print(f"🗜️ 封面重新編碼: {len(cover_data):,} → {len(encoded_cover):,} bytes")
+        cover_data = encoded_cover
+    
+    # 步驟3: 注入XMP，Container長度直接以最終的主要圖片大小計算
+    print(f"📝 注入XMP元數據...")
+    if hasattr(video_path, 'seek'):
+        video_size = video_path.seek(0, os.SEEK_END)
+    else:
+        video_size = os.path.getsize(video_path)
+    with stage_timer(metrics, 'xmp'):
+        primary_image = build_primary_image(cover_data, video_size, padding=xmp_padding)
+    
+    print(f"📏 主要圖片大小 (含XMP): {len(primary_image):,} bytes")
+    print(f"📏 影片大小: {video_size:,} bytes")
+    
+    return primary_image, video_size
+
+def check_motion_photo_header(primary_image, video_size, output_name):
+    """以 verify.py 的規則檢查記憶體中的主要圖片，回傳未通過的檢查項目（空清單表示通過）
+
+    項目名稱與 verify.CHECKS 相同；Container長度另外與實際的主要圖片和影片大小比對。
+    """
+    failures = []
+    if not str(output_name).endswith('.MP.jpg'):
+        failures.append('filename')
+    if primary_image[:2] != b'\xff\xd8':
+        failures.append('file_type')
+    
+    found = find_xmp_segment(io.BytesIO(primary_image))
+    try:
+        rdf = etree.fromstring(found[2]) if found else None
+    except etree.XMLSyntaxError:
+        rdf = None
+    if rdf is None:
+        return failures + ['xmp_metadata', 'container_directory']
+    
+    namespaces = {'rdf': RDF_NS, 'Container': CONTAINER_NS, 'Camera': CAMERA_NS}
+    def text(path, element=rdf):
+        return element.findtext(path, namespaces=namespaces)
+    
+    timestamp = text('.//Camera:MotionPhotoPresentationTimestampUs')
+    if (text('.//Camera:MotionPhoto') != '1' or text('.//Camera:MotionPhotoVersion') != '1'
+            or timestamp is None or not re.fullmatch(r'-?\d+', timestamp) or int(timestamp) < -1):
+        failures.append('xmp_metadata')
+    
+    items = [(text('Container:Semantic', item), text('Container:Mime', item), text('Container:Length', item))
+             for item in rdf.iterfind('.//Container:Directory/rdf:Seq/rdf:li/Container:Item', namespaces)]
+    expected = [('Primary', 'image/jpeg', str(len(primary_image))), ('MotionPhoto', 'video/mp4', str(video_size))]
+    if items != expected:
+        failures.append('container_directory')
+    
+    return failures
+
+def probe_video_offset(path, video_offset, video_size, video_head):
+    """檢查寫出的檔案大小，並以一次讀取確認影片偏移處是來源影片的開頭"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size != video_offset + video_size:
+            return False
+        f.seek(video_offset)
+        return f.read(len(video_head)) == video_head
+
+def verify_written_output(primary_image, video_size, video_path, written_path, output_name, metrics=None):
+    """驗證剛寫出（尚未改名）的Motion Photo，未通過時拋出 ValueError"""
+    with stage_timer(metrics, 'verify'):
+        failures = check_motion_photo_header(primary_image, video_size, output_name)
+        with open(video_path, 'rb') as f_video:
+            video_head = f_video.read(VIDEO_PROBE_SIZE)
+        if not probe_video_offset(written_path, len(primary_image), video_size, video_head):
+            failures.append('file_structure')
+    if metrics is not None:
+        metrics.inc('verifications_total', result='failure' if failures else 'success')
+        for reason in failures:
+            metrics.inc('verification_failures_total', reason=reason)
+    if failures:
+        raise ValueError(f"寫入驗證失敗: {', '.join(failures)}")
+    print(f"✅ 寫入驗證通過")
+
+def convert_to_motion_photo(video_path, output_path=None, xmp_padding=XMP_PADDING, thumbnail_sizes=None,
+                            backend=None, cover_options=None, metrics=None, verify=False):
+    """轉換影片為Motion Photo，可同時在輸出旁產生縮圖
+
+    cover_options 為 encode_cover() 的參數，在注入XMP前重新編碼封面。
+    metrics 為 MetricsSink 時記錄結果、耗時和大小，並在每次轉換後更新指標檔案。
+    verify 為 True 時在改名前以記憶體中的標頭和已知大小驗證輸出，不需要再執行 verify.py。
+    """
     video_path = Path(video_path)
     
     if not video_path.exists():
@@ -202,59 +806,371 @@ def convert_to_motion_photo(video_path, output_path=None):
     
     print(f"🎯 轉換 {video_path} → {output_path}")
     
-    # 臨時檔案
-    cover_path = "cover.jpg"
+    # 臨時檔案（依輸出檔名區分，讓多個轉換可以同時進行）
+    # 輸出先寫到 .partial，完成後才改名，中斷時不會留下不完整的 .MP.jpg
+    cover_path = f"{output_path}.cover.jpg"
+    partial_path = f"{output_path}.partial"
     
     try:
-        # 步驟1: 提取封面
-        extract_frame(str(video_path), cover_path)
-        
-        # 步驟2: 生成初始XMP來估算大小
-        temp_xmp = generate_xmp_with_size(os.path.getsize(cover_path), str(video_path))
-        inject_xmp_metadata(cover_path, temp_xmp)
-        
-        # 步驟3: 計算包含XMP後的實際主要圖片大小
-        primary_image_with_xmp_size = os.path.getsize(cover_path)
-        video_size = os.path.getsize(str(video_path))
+        # 步驟1-3: 提取封面、重新編碼並注入XMP（縮圖在同一次解碼中產生）
+        thumbnails = {size: str(thumbnail_path(output_path, size)) for size in thumbnail_sizes or []}
+        primary_image, video_size = prepare_primary_image(
+            str(video_path), cover_path, thumbnails, backend, cover_options, xmp_padding, metrics)
         
-        print(f"📏 主要圖片大小 (含XMP): {primary_image_with_xmp_size:,} bytes")
-        print(f"📏 影片大小: {video_size:,} bytes")
+        # 步驟4: 最終合併檔案
+        print(f"🔗 合併JPEG和影片數據...")
+        with stage_timer(metrics, 'write'):
+            write_motion_photo(primary_image, str(video_path), partial_path)
         
-        # 步驟4: 生成最終正確的XMP元數據
-        final_xmp = generate_xmp_with_size(primary_image_with_xmp_size, str(video_path))
-        inject_xmp_metadata(cover_path, final_xmp)
+        # 驗證（可選）: 未通過時不會產生正式輸出
+        if verify:
+            verify_written_output(primary_image, video_size, video_path, partial_path, output_path, metrics)
         
-        # 步驟5: 最終合併檔案
-        append_video_to_jpeg(cover_path, str(video_path), str(output_path))
+        with stage_timer(metrics, 'sync'):
+            replace_atomically(partial_path, output_path)
+        print(f"✅ 檔案合併完成: {video_size:,} bytes 影片數據")
         
-        # 步驟6: 清理臨時檔案
+        # 步驟5: 清理臨時檔案
         if os.path.exists(cover_path):
             os.remove(cover_path)
             print(f"🗑️ 已清理臨時檔案: {cover_path}")
         
         print(f"🎉 Motion Photo 已創建: {output_path}")
+        if metrics is not None:
+            output_size = len(primary_image) + video_size
+            metrics.inc('conversions_total', result='success')
+            metrics.inc('bytes_processed_total', video_size, direction='read')
+            metrics.inc('bytes_processed_total', output_size, direction='written')
+            metrics.observe_size('video', video_size)
+            metrics.observe_size('primary_image', len(primary_image))
+            metrics.observe_size('motion_photo', output_size)
+            metrics.write()
         return True
         
     except Exception as e:
         print(f"❌ 轉換失敗: {e}")
         # 清理臨時檔案
-        if os.path.exists(cover_path):
-            os.remove(cover_path)
+        for temp_path in (cover_path, partial_path):
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        if metrics is not None:
+            metrics.inc('conversions_total', result='failure')
+            metrics.write()
         return False
 
+def spool_stdin(stream, limit=STDIN_SPOOL_LIMIT):
+    """讀取標準輸入到可 seek 的檔案物件，回傳 (檔案物件, 暫存檔路徑或 None)
+
+    小於 limit 的輸入留在記憶體；超過時才寫到暫存檔（由呼叫者刪除）。
+    """
+    buffer = io.BytesIO()
+    while True:
+        chunk = stream.read(COPY_CHUNK_SIZE)
+        if not chunk:
+            buffer.seek(0)
+            return buffer, None
+        buffer.write(chunk)
+        if buffer.tell() > limit:
+            break
+    
+    spool = tempfile.NamedTemporaryFile(suffix='.video', delete=False)
+    spool.write(buffer.getbuffer())
+    del buffer
+    shutil.copyfileobj(stream, spool, COPY_CHUNK_SIZE)
+    spool.flush()
+    spool.seek(0)
+    return spool, spool.name
+
+def convert_pipe(video_path, output_path, xmp_padding=XMP_PADDING, backend=None, cover_options=None):
+    """轉換影片為Motion Photo，輸入或輸出可以是 '-'（標準輸入/標準輸出）
+
+    寫到標準輸出時，主要圖片先在記憶體中算好長度，之後直接串流影片數據，不經過暫存檔。
+    """
+    to_stdout = output_path == '-'
+    output_stream = sys.stdout.buffer if to_stdout else None
+    # 標準輸出是資料串流，進度訊息改寫到標準錯誤
+    redirect = contextlib.redirect_stdout(sys.stderr) if to_stdout else contextlib.nullcontext()
+    
+    with redirect, contextlib.ExitStack() as cleanup:
+        work_dir = cleanup.enter_context(tempfile.TemporaryDirectory())
+        try:
+            if video_path == '-':
+                video, spool_path = spool_stdin(sys.stdin.buffer)
+                cleanup.callback(video.close)
+                if spool_path:
+                    cleanup.callback(os.remove, spool_path)
+                print(f"📥 已讀取標準輸入 ({'暫存檔' if spool_path else '記憶體'})")
+            else:
+                video = cleanup.enter_context(open(video_path, 'rb'))
+                spool_path = video_path
+            
+            # 在記憶體中的輸入只有支援檔案物件的後端能直接讀取，否則寫到暫存檔給ffmpeg
+            source = spool_path
+            if source is None:
+                if get_backend(backend).accepts_file_objects:
+                    source = video
+                else:
+                    source = os.path.join(work_dir, 'input.video')
+                    with open(source, 'wb') as f_spool:
+                        f_spool.write(video.getbuffer())
+            
+            primary_image, video_size = prepare_primary_image(
+                source, os.path.join(work_dir, 'cover.jpg'), None, backend, cover_options, xmp_padding)
+            
+            print(f"🔗 合併JPEG和影片數據...")
+            if to_stdout:
+                output = output_stream
+            else:
+                partial_path = f"{output_path}.partial"
+                output = cleanup.enter_context(open(partial_path, 'wb'))
+            
+            output.write(primary_image)
+            video.seek(0)
+            shutil.copyfileobj(video, output, COPY_CHUNK_SIZE)
+            output.flush()
+            
+            if not to_stdout:
+                output.close()
+                replace_atomically(partial_path, output_path)
+            
+            print(f"🎉 Motion Photo 已創建: {'標準輸出' if to_stdout else output_path} "
+                  f"({len(primary_image) + video_size:,} bytes)")
+            return True
+        
+        except Exception as e:
+            print(f"❌ 轉換失敗: {e}")
+            if not to_stdout and os.path.exists(f"{output_path}.partial"):
+                os.remove(f"{output_path}.partial")
+            return False
+
+def parse_max_size(value):
+    """解析最大尺寸 (1920 或 1920x1080)"""
+    try:
+        if 'x' in value:
+            width, height = (int(part) for part in value.split('x', 1))
+        else:
+            width = height = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"無效的尺寸: {value}")
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError(f"尺寸必須為正整數: {value}")
+    return width, height
+
+def add_cover_arguments(parser):
+    """加入封面編碼相關的命令列選項"""
+    group = parser.add_argument_group('封面編碼')
+    group.add_argument('--quality', type=int, choices=range(1, 96), metavar='1-95',
+                       help=f'封面JPEG品質（重新編碼時預設 {COVER_QUALITY}）')
+    group.add_argument('--optimize', action='store_true', help='最佳化Huffman表')
+    group.add_argument('--progressive', action='store_true', help='輸出漸進式JPEG')
+    group.add_argument('--subsampling', choices=['4:4:4', '4:2:2', '4:2:0'], help='色度取樣')
+    group.add_argument('--max-size', type=parse_max_size, help='封面最大尺寸 (例如 1920 或 1920x1080)')
+    group.add_argument('--strip', action='store_true', help='移除不需要的APP段和註解')
+
+def cover_options_from_args(args):
+    """由命令列參數建立 encode_cover() 的參數，未指定任何選項時回傳 None"""
+    options = {
+        'quality': args.quality,
+        'optimize': args.optimize,
+        'progressive': args.progressive,
+        'subsampling': args.subsampling,
+        'max_size': args.max_size,
+        'strip': args.strip,
+    }
+    if not any(value for value in options.values()):
+        return None
+    return options
+
+def parse_sizes(value):
+    """解析以逗號分隔的像素大小列表"""
+    try:
+        sizes = [int(size) for size in value.split(',') if size.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"無效的大小列表: {value}")
+    if any(size <= 0 for size in sizes):
+        raise argparse.ArgumentTypeError(f"大小必須為正整數: {value}")
+    return sizes
+
+def parse_profile(value):
+    """解析輸出規格 name[:高度[:位元率[:秒數]]]，空欄位表示沿用來源"""
+    fields = value.split(':')
+    if not fields[0] or len(fields) > 4:
+        raise argparse.ArgumentTypeError(f"無效的輸出規格: {value}")
+    fields += [''] * (4 - len(fields))
+    name, height, bitrate, duration = fields
+    try:
+        return {
+            'name': name,
+            'height': int(height) if height else None,
+            'bitrate': bitrate or None,
+            'duration': float(duration) if duration else None,
+        }
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"無效的輸出規格: {value}")
+
+def transcode_renditions(video_path, profiles, work_dir, high_quality=False):
+    """以一次解碼產生每個規格的內嵌影片和封面，回傳 [(影片路徑, 封面路徑)]"""
+    print(f"🎞️ 轉碼 {len(profiles)} 個規格: {video_path}")
+    
+    # 每個規格各取兩路畫面：一路編碼影片，一路輸出封面
+    branches = "".join(f"[v{index}][c{index}]" for index in range(len(profiles)))
+    filters = [f"[0:v]split={len(profiles) * 2}{branches}"]
+    for index, profile in enumerate(profiles):
+        if profile['height']:
+            scale = f"scale=-2:'min({profile['height']},ih)'"
+        else:
+            scale = "null"
+        filters.append(f"[v{index}]{scale}[ov{index}]")
+        filters.append(f"[c{index}]{scale}[oc{index}]")
+    
+    command = ["ffmpeg", "-y", "-i", video_path, "-filter_complex", ";".join(filters)]
+    outputs = []
+    for index, profile in enumerate(profiles):
+        rendition_video = os.path.join(work_dir, f"{index}.mp4")
+        rendition_cover = os.path.join(work_dir, f"{index}.jpg")
+        
+        command += ["-map", f"[ov{index}]", "-map", "0:a?",
+                    "-c:v", "libx264", "-pix_fmt", "yuv420p", "-c:a", "aac",
+                    "-movflags", "+faststart"]
+        if profile['bitrate']:
+            command += ["-b:v", profile['bitrate']]
+        if profile['duration']:
+            command += ["-t", str(profile['duration'])]
+        command.append(rendition_video)
+        
+        command += ["-map", f"[oc{index}]", "-ss", FRAME_TIMESTAMP, "-vframes", "1"]
+        if high_quality:
+            command += ["-q:v", "1"]
+        command.append(rendition_cover)
+        outputs.append((rendition_video, rendition_cover))
+    
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to transcode renditions: {result.stderr.decode()}")
+    print(f"✅ 轉碼完成")
+    return outputs
+
+def convert_to_motion_photo_renditions(video_path, profiles, output_dir=None, xmp_padding=XMP_PADDING,
+                                       cover_options=None):
+    """以一次解碼將影片轉換為多個規格的Motion Photo (video.<name>.MP.jpg)"""
+    video_path = Path(video_path)
+    
+    if not video_path.exists():
+        print(f"❌ 找不到影片檔案: {video_path}")
+        return False
+    
+    output_dir = Path(output_dir) if output_dir is not None else video_path.parent
+    partial_path = None
+    
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            renditions = transcode_renditions(str(video_path), profiles, work_dir,
+                                              cover_reencodes(cover_options))
+            
+            for profile, (rendition_video, rendition_cover) in zip(profiles, renditions):
+                output_path = output_dir / f"{video_path.stem}.{profile['name']}.MP.jpg"
+                
+                with open(rendition_cover, 'rb') as f_cover:
+                    cover_data = f_cover.read()
+                if cover_options:
+                    cover_data = encode_cover(cover_data, **cover_options)
+                video_size = os.path.getsize(rendition_video)
+                primary_image = build_primary_image(cover_data, video_size, padding=xmp_padding)
+                
+                partial_path = f"{output_path}.partial"
+                write_motion_photo(primary_image, rendition_video, partial_path)
+                replace_atomically(partial_path, output_path)
+                print(f"🎉 Motion Photo 已創建: {output_path} "
+                      f"(主要圖片 {len(primary_image):,} bytes, 影片 {video_size:,} bytes)")
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ 轉換失敗: {e}")
+        # 移除寫到一半的輸出，已完成的規格保留
+        if partial_path is not None and os.path.exists(partial_path):
+            os.remove(partial_path)
+        return False
+
+def renditions_main(argv):
+    """renditions 子命令：一次解碼輸出多個規格的Motion Photo"""
+    parser = argparse.ArgumentParser(prog='main.py renditions', description='以一次解碼輸出多個規格的Motion Photo')
+    parser.add_argument('video', help='影片檔案')
+    parser.add_argument('--profile', dest='profiles', type=parse_profile, action='append', required=True,
+                        help='輸出規格 name[:高度[:位元率[:秒數]]]，可重複指定 (例如 full 或 mobile:720:2M:3)')
+    parser.add_argument('--output-dir', help='輸出目錄（預設與影片相同）')
+    add_cover_arguments(parser)
+    args = parser.parse_args(argv)
+    
+    names = [profile['name'] for profile in args.profiles]
+    if len(set(names)) != len(names):
+        parser.error('規格名稱不可重複')
+    
+    success = convert_to_motion_photo_renditions(args.video, args.profiles, args.output_dir,
+                                                 cover_options=cover_options_from_args(args))
+    sys.exit(0 if success else 1)
+
+def update_main(argv):
+    """update 子命令：就地更新現有的Motion Photo"""
+    parser = argparse.ArgumentParser(prog='main.py update', description='就地更新Motion Photo的元數據或封面')
+    parser.add_argument('photo', help='Motion Photo檔案 (.MP.jpg)')
+    parser.add_argument('--timestamp', type=int, help='MotionPhotoPresentationTimestampUs (微秒)')
+    parser.add_argument('--cover', help='新的封面JPEG檔案')
+    args = parser.parse_args(argv)
+    
+    if args.timestamp is None and args.cover is None:
+        parser.error('請指定 --timestamp 或 --cover')
+    
+    success = update_motion_photo(args.photo, args.timestamp, args.cover)
+    sys.exit(0 if success else 1)
+
 def main():
     if len(sys.argv) < 2:
         print("使用方法:")
-        print("  python main.py <影片檔案> [輸出檔案.MP.jpg]")
+        print("  python main.py <影片檔案> [輸出檔案.MP.jpg] [--thumbnails 256,1024]")
+        print("  python main.py update <Motion Photo檔案> [--timestamp 微秒] [--cover 封面.jpg]")
+        print("  python main.py renditions <影片檔案> --profile name[:高度[:位元率[:秒數]]] ...")
         print("範例:")
         print("  python main.py video.mp4")
         print("  python main.py video.mp4 output.MP.jpg")
+        print("  python main.py video.mp4 --thumbnails 256,1024")
+        print("  python main.py update video.MP.jpg --timestamp 500000")
+        print("  python main.py renditions video.mp4 --profile full --profile mobile:720:2M")
+        print("  curl -s https://example.com/clip.mp4 | python main.py - - > clip.MP.jpg")
+        return
+    
+    if sys.argv[1] == 'update':
+        update_main(sys.argv[2:])
         return
     
-    video_file = sys.argv[1]
-    output_file = sys.argv[2] if len(sys.argv) > 2 else None
+    if sys.argv[1] == 'renditions':
+        renditions_main(sys.argv[2:])
+        return
+    
+    parser = argparse.ArgumentParser(prog='main.py', description='將影片轉換為Motion Photo')
+    parser.add_argument('video', help="影片檔案（'-' 為標準輸入）")
+    parser.add_argument('output', nargs='?', help="輸出檔案 (.MP.jpg，'-' 為標準輸出；輸入為 '-' 時預設為標準輸出)")
+    parser.add_argument('--thumbnails', type=parse_sizes, default=[],
+                        help='同時輸出的縮圖最長邊像素，以逗號分隔 (例如 256,1024)')
+    parser.add_argument('--backend', choices=['auto', 'ffmpeg', 'pyav'], default='auto',
+                        help='封面提取後端（預設 auto: 選擇最快的可用後端）')
+    parser.add_argument('--metrics-file', help='將Prometheus指標寫到此檔案（供 node_exporter textfile collector 讀取）')
+    parser.add_argument('--verify', action='store_true', help='寫入後立即驗證輸出（不需要另外執行 verify.py）')
+    add_cover_arguments(parser)
+    args = parser.parse_args()
+    
+    if args.video == '-' or args.output == '-':
+        if args.thumbnails or args.metrics_file or args.verify:
+            parser.error("--thumbnails、--metrics-file 和 --verify 不能與標準輸入/輸出一起使用")
+        success = convert_pipe(args.video, args.output or '-', backend=args.backend,
+                               cover_options=cover_options_from_args(args))
+        sys.exit(0 if success else 1)
     
-    convert_to_motion_photo(video_file, output_file)
+    metrics = MetricsSink(args.metrics_file) if args.metrics_file else None
+    success = convert_to_motion_photo(args.video, args.output, thumbnail_sizes=args.thumbnails, backend=args.backend,
+                                      cover_options=cover_options_from_args(args), metrics=metrics,
+                                      verify=args.verify)
+    sys.exit(0 if success else 1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+MotionCraft - Prometheus Metrics
+Write conversion and verification metrics in the Prometheus text format for node_exporter's textfile collector
+以Prometheus文字格式輸出轉換與驗證的統計數據，供 node_exporter 的 textfile collector 讀取
+"""
+
+import os
+import time
+import threading
+import contextlib
+
+PREFIX = 'motioncraft'
+
+# 各階段耗時的直方圖區間（秒）
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# 檔案大小的直方圖區間（bytes）
+SIZE_BUCKETS = tuple(4 ** power * 1024 for power in range(3, 13))
+
+# 指標名稱 -> (類型, 說明)
+METRICS = {
+    'conversions_total': ('counter', 'Motion Photo conversions by result'),
+    'verifications_total': ('counter', 'Motion Photo verifications by result'),
+    'verification_failures_total': ('counter', 'Failed verification checks by reason'),
+    'bytes_processed_total': ('counter', 'Bytes read from sources and written to outputs'),
+    'stage_duration_seconds': ('histogram', 'Duration of each conversion and verification stage'),
+    'file_size_bytes': ('histogram', 'Size of processed files by kind'),
+    'last_update_timestamp_seconds': ('gauge', 'Unix time of the last metrics update'),
+}
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    """將標籤轉為 {name="value"} 格式"""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in labels) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsSink:
+    """累計計數器與直方圖，並以原子方式覆寫 .prom 檔案
+
+    同一個檔案只應由一個行程寫入；多個工作請使用不同的檔案。
+    """
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        self.counters = {}
+        self.histograms = {}
+        # watch.py 的工作執行緒會同時記錄
+        self.lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, buckets, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': buckets, 'counts': [0] * len(buckets),
+                                                    'sum': 0, 'count': 0}
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['counts'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def observe_size(self, kind, size):
+        self.observe('file_size_bytes', size, SIZE_BUCKETS, kind=kind)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """記錄區塊的耗時（發生例外時也會記錄）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('stage_duration_seconds', time.perf_counter() - start, LATENCY_BUCKETS, stage=name)
+
+    def render(self):
+        """產生Prometheus文字格式的內容"""
+        series = {}
+        with self.lock:
+            for (name, labels), value in self.counters.items():
+                series.setdefault(name, []).append(f"{PREFIX}_{name}{format_labels(labels)} {format_value(value)}")
+            for (name, labels), histogram in self.histograms.items():
+                lines = series.setdefault(name, [])
+                for bound, count in zip(histogram['buckets'], histogram['counts']):
+                    bucket_labels = labels + (('le', format_value(float(bound))),)
+                    lines.append(f"{PREFIX}_{name}_bucket{format_labels(bucket_labels)} {count}")
+                lines.append(f"{PREFIX}_{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+                lines.append(f"{PREFIX}_{name}_sum{format_labels(labels)} {format_value(histogram['sum'])}")
+                lines.append(f"{PREFIX}_{name}_count{format_labels(labels)} {histogram['count']}")
+        series['last_update_timestamp_seconds'] = [f"{PREFIX}_last_update_timestamp_seconds {time.time():.3f}"]
+
+        output = []
+        for name, (kind, description) in METRICS.items():
+            if name in series:
+                output.append(f"# HELP {PREFIX}_{name} {description}")
+                output.append(f"# TYPE {PREFIX}_{name} {kind}")
+                output.extend(series[name])
+        return '\n'.join(output) + '\n'
+
+    def write(self):
+        """寫到同一資料夾的暫存檔再改名，collector 不會讀到寫一半的檔案"""
+        content = self.render()
+        # 暫存檔不以 .prom 結尾，避免被 collector 讀取
+        temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(temp_path, self.path)
+
+def stage_timer(metrics, name):
+    """metrics 為 None 時不記錄"""
+    return metrics.stage(name) if metrics is not None else contextlib.nullcontext()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+MotionCraft - Embedded Video Server
+Stream the video embedded in Motion Photos over HTTP with byte-range support
+以HTTP串流Motion Photo內嵌的影片，支援Range請求，不需另外提取MP4
+"""
+
+import os
+import re
+import sys
+import argparse
+from functools import lru_cache
+from email.utils import formatdate
+from urllib.parse import unquote, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from main import locate_motion_photo_video
+
+RANGE_PATTERN = re.compile(r'bytes=(\d*)-(\d*)$')
+
+@lru_cache(maxsize=4096)
+def _video_window(path, size, mtime_ns):
+    with open(path, 'rb') as f:
+        layout = locate_motion_photo_video(f)
+    return layout['video_offset'], layout['video_size']
+
+def video_window(path):
+    """回傳內嵌影片在檔案中的 (偏移, 長度)，支援舊版和廠商格式；依檔案大小和修改時間快取"""
+    stat = os.stat(path)
+    return _video_window(path, stat.st_size, stat.st_mtime_ns)
+
+def parse_range(header, length):
+    """解析單一 Range 標頭，回傳 (開始, 結束) 或 None（整個內容）；無法滿足時拋出 ValueError"""
+    if not header:
+        return None
+    match = RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None  # 不支援的格式（例如多個範圍）時回傳整個內容
+    first, last = match.groups()
+    if not first:
+        if not last or int(last) == 0:
+            raise ValueError("unsatisfiable range")
+        start = max(length - int(last), 0)
+        end = length - 1
+    else:
+        start = int(first)
+        end = min(int(last), length - 1) if last else length - 1
+        if last and int(last) < start:
+            return None
+    if start >= length:
+        raise ValueError("unsatisfiable range")
+    return start, end
+
+class MotionPhotoHandler(BaseHTTPRequestHandler):
+    """/video/<路徑> 回傳內嵌影片，/photo/<路徑> 回傳整個Motion Photo"""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MotionCraft'
+    root = '.'
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def resolve(self, relative_path):
+        """將URL路徑對應到根目錄下的檔案，拒絕跳出根目錄"""
+        root = os.path.realpath(self.root)
+        path = os.path.realpath(os.path.join(root, unquote(relative_path).lstrip('/')))
+        if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+            return None
+        return path
+
+    def handle_request(self, send_body):
+        url_path = urlsplit(self.path).path
+        kind, _, relative_path = url_path.lstrip('/').partition('/')
+        path = self.resolve(relative_path) if kind in ('video', 'photo') else None
+        if path is None:
+            self.send_error(404)
+            return
+
+        try:
+            if kind == 'video':
+                offset, length = video_window(path)
+                content_type = 'video/mp4'
+            else:
+                offset, length = 0, os.path.getsize(path)
+                content_type = 'image/jpeg'
+        except (OSError, ValueError) as e:
+            # 狀態行只能是latin-1，中文的錯誤訊息放在回應內容
+            self.send_error(422, "Not a Motion Photo", str(e))
+            return
+
+        stat = os.stat(path)
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}-{kind}"'
+        try:
+            byte_range = parse_range(self.headers.get('Range'), length)
+            if byte_range and self.headers.get('If-Range') not in (None, etag):
+                byte_range = None
+        except ValueError:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{length}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if byte_range is None:
+            start, end = 0, length - 1
+            self.send_response(200)
+        else:
+            start, end = byte_range
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{length}')
+
+        count = end - start + 1 if length else 0
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(count))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(stat.st_mtime, usegmt=True))
+        self.end_headers()
+
+        if send_body and count:
+            with open(path, 'rb') as f:
+                # socket.sendfile 在支援的平台上使用 os.sendfile，資料不經過使用者空間
+                self.connection.sendfile(f, offset + start, count)
+
+def serve(root='.', host='127.0.0.1', port=8000):
+    """啟動Motion Photo影片伺服器"""
+    handler = type('Handler', (MotionPhotoHandler,), {'root': root})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"🌐 提供 {os.path.abspath(root)} 中的Motion Photo")
+    print(f"   🎥 影片: http://{host}:{server.server_port}/video/<檔案.MP.jpg>")
+    print(f"   🖼️ 圖片: http://{host}:{server.server_port}/photo/<檔案.MP.jpg>")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 伺服器已停止")
+    finally:
+        server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description='以HTTP串流Motion Photo內嵌的影片（支援Range請求）')
+    parser.add_argument('root', nargs='?', default='.', help='提供檔案的根目錄（預設為目前目錄）')
+    parser.add_argument('--host', default='127.0.0.1', help='監聽位址（預設 127.0.0.1）')
+    parser.add_argument('--port', type=int, default=8000, help='監聽埠（預設 8000）')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.root):
+        print(f"❌ 找不到資料夾: {args.root}")
+        sys.exit(1)
+
+    serve(args.root, args.host, args.port)
+
+if __name__ == "__main__":
+    main()
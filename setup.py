@@ -51,6 +51,18 @@ def check_python_module(module_name, import_name=None):
         print(f"   ❌ {module_name}: 未安裝")
         return False
 
+def check_backends():
+    """檢查可用的封面提取後端"""
+    try:
+        from backends import available_backends, get_backend
+        names = [backend.name for backend in available_backends()]
+        if names:
+            print(f"   🎬 封面提取後端: {', '.join(names)} (自動選擇: {get_backend().name})")
+        else:
+            print("   ❌ 沒有可用的封面提取後端")
+    except Exception as e:
+        print(f"   ⚠️ 無法檢查封面提取後端: {e}")
+
 def check_dependencies():
     """檢查所有依賴"""
     print("🔍 檢查系統依賴:")
@@ -65,6 +77,11 @@ def check_dependencies():
     lxml_ok = check_python_module('lxml')
     pillow_ok = check_python_module('Pillow', 'PIL')
     
+    print("\n🔍 檢查可選模組:")
+    check_python_module('PyAV', 'av')
+    check_python_module('pillow-heif', 'pillow_heif')
+    check_backends()
+    
     print()
     
     missing = []
@@ -194,6 +211,7 @@ def setup_environment():
                 print("🐍 安裝lxml: uv add lxml 或 pip install lxml")
             if 'Pillow' in missing:
                 print("🐍 安裝Pillow: uv add Pillow 或 pip install Pillow")
+            print("🐍 (可選) 安裝PyAV以在同一行程內提取封面: uv add av 或 pip install av")
             return False
             
     except KeyboardInterrupt:
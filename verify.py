@@ -6,10 +6,15 @@ Verify Motion Photo files comply with Google Motion Photos 1.0 specification
 """
 
 import os
+import re
 import sys
+import argparse
 import subprocess
 from pathlib import Path
 
+from main import LAYOUT_NAMES, locate_motion_photo_video
+from metrics import MetricsSink, stage_timer
+
 def check_filename(filepath):
     """檢查檔案名稱是否符合規範"""
     print("1️⃣ 檔案名稱檢查:")
@@ -74,10 +79,11 @@ def check_xmp_metadata(filepath):
                 print(f"   ❌ MotionPhotoVersion = {version} (應為 1)")
                 return False
                 
-            if timestamp == '0':
-                print("   ✅ MotionPhotoPresentationTimestampUs = 0")
+            # 時間戳可由 main.py update 修改，-1 表示未指定
+            if timestamp is not None and re.fullmatch(r'-?\d+', timestamp) and int(timestamp) >= -1:
+                print(f"   ✅ MotionPhotoPresentationTimestampUs = {timestamp}")
             else:
-                print(f"   ❌ MotionPhotoPresentationTimestampUs = {timestamp} (應為 0)")
+                print(f"   ❌ MotionPhotoPresentationTimestampUs = {timestamp} (應為 >= -1 的整數)")
                 return False
                 
             return True
@@ -163,28 +169,84 @@ def check_file_structure(filepath):
         print(f"   ❌ 檢查檔案結構時發生錯誤: {e}")
         return False
 
-def verify_motion_photo(filepath):
-    """完整驗證Motion Photo檔案"""
+def check_video_location(filepath):
+    """以分層定位找出內嵌影片（Container XMP → MicroVideoOffset → 廠商尾端標記）"""
+    print("6️⃣ 內嵌影片位置檢查:")
+    try:
+        with open(filepath, 'rb') as f:
+            layout = locate_motion_photo_video(f)
+        print(f"   ✅ 格式: {LAYOUT_NAMES.get(layout['layout'], layout['layout'])}")
+        print(f"   📍 影片範圍: {layout['video_offset']:,} - {layout['video_offset'] + layout['video_size']:,} "
+              f"({layout['video_size']:,} bytes)")
+        return True
+    except ValueError as e:
+        print(f"   ❌ {e}")
+        return False
+    except Exception as e:
+        print(f"   ❌ 檢查內嵌影片位置時發生錯誤: {e}")
+        return False
+
+# 檢查項目與失敗時記錄的原因
+CHECKS = [
+    ('filename', check_filename),
+    ('file_type', check_file_type),
+    ('xmp_metadata', check_xmp_metadata),
+    ('container_directory', check_container_directory),
+    ('file_structure', check_file_structure),
+    ('video_location', check_video_location),
+]
+
+# 舊版和廠商格式不適用 Motion Photo 1.0 的檔名和XMP規則，只檢查這些項目
+LEGACY_CHECKS = {'file_type', 'file_structure', 'video_location'}
+
+def detect_layout(filepath):
+    """回傳內嵌影片的格式名稱，找不到時回傳 None"""
+    try:
+        with open(filepath, 'rb') as f:
+            return locate_motion_photo_video(f)['layout']
+    except (OSError, ValueError):
+        return None
+
+def verify_motion_photo(filepath, metrics=None):
+    """完整驗證Motion Photo檔案
+
+    metrics 為 MetricsSink 時依原因記錄失敗的檢查，並在驗證後更新指標檔案。
+    """
     if not os.path.exists(filepath):
         print(f"❌ 找不到檔案: {filepath}")
+        if metrics is not None:
+            metrics.inc('verifications_total', result='failure')
+            metrics.inc('verification_failures_total', reason='missing')
+            metrics.write()
         return False
     
     print(f"🔍 驗證Motion Photo檔案: {filepath}")
     print("=" * 60)
     
-    checks = [
-        check_filename(filepath),
-        check_file_type(filepath),
-        check_xmp_metadata(filepath),
-        check_container_directory(filepath),
-        check_file_structure(filepath)
-    ]
+    layout = detect_layout(filepath)
+    checks_to_run = CHECKS
+    if layout not in (None, 'container'):
+        print(f"ℹ️ 偵測到{LAYOUT_NAMES[layout]}格式，略過檔名和Container XMP檢查")
+        checks_to_run = [(reason, check) for reason, check in CHECKS if reason in LEGACY_CHECKS]
+    
+    checks = []
+    with stage_timer(metrics, 'verify'):
+        for reason, check in checks_to_run:
+            passed = check(filepath)
+            checks.append(passed)
+            if not passed and metrics is not None:
+                metrics.inc('verification_failures_total', reason=reason)
     
     print("\n" + "=" * 60)
     
     passed = sum(checks)
     total = len(checks)
     
+    if metrics is not None:
+        metrics.inc('verifications_total', result='success' if passed == total else 'failure')
+        metrics.observe_size('motion_photo', os.path.getsize(filepath))
+        metrics.write()
+    
     if passed == total:
         print("🎉 Motion Photo驗證完成! 所有檢查都通過!")
         return True
@@ -195,13 +257,19 @@ def verify_motion_photo(filepath):
 def main():
     if len(sys.argv) < 2:
         print("使用方法:")
-        print("  python verify.py <Motion Photo檔案>")
+        print("  python verify.py <Motion Photo檔案> [...] [--metrics-file 檔案.prom]")
         print("範例:")
         print("  python verify.py photo.MP.jpg")
         return
     
-    filepath = sys.argv[1]
-    verify_motion_photo(filepath)
+    parser = argparse.ArgumentParser(prog='verify.py', description='驗證Motion Photo檔案')
+    parser.add_argument('files', nargs='+', help='Motion Photo檔案')
+    parser.add_argument('--metrics-file', help='將Prometheus指標寫到此檔案（供 node_exporter textfile collector 讀取）')
+    args = parser.parse_args()
+    
+    metrics = MetricsSink(args.metrics_file) if args.metrics_file else None
+    for filepath in args.files:
+        verify_motion_photo(filepath, metrics)
 
 if __name__ == "__main__":
     main()
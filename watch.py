@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+MotionCraft - Watch Folder Daemon
+Convert videos dropped into a directory into Motion Photos as soon as they are complete
+監看資料夾，將寫入完成的影片自動轉換為Motion Photo
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import shutil
+import struct
+import argparse
+import ctypes
+import ctypes.util
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from main import VIDEO_EXTENSIONS, convert_to_motion_photo
+from metrics import MetricsSink
+
+# inotify 事件 (見 <sys/inotify.h>)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+INOTIFY_EVENT = struct.Struct('iIII')
+
+def open_inotify(directory):
+    """建立 inotify 監看，不支援時回傳 None（改用輪詢）"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return None
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+def read_inotify_events(fd, timeout):
+    """等待 inotify 事件，回傳有變動的檔名；佇列溢位時回傳 None 表示需要重新掃描"""
+    readable, _, _ = select.select([fd], [], [], timeout)
+    if not readable:
+        return []
+
+    try:
+        data = os.read(fd, 64 * 1024)
+    except OSError as e:
+        if e.errno == errno.EAGAIN:
+            return []
+        raise
+
+    names = []
+    offset = 0
+    while offset + INOTIFY_EVENT.size <= len(data):
+        _, mask, _, name_length = INOTIFY_EVENT.unpack_from(data, offset)
+        offset += INOTIFY_EVENT.size
+        name = data[offset:offset + name_length].rstrip(b'\x00')
+        offset += name_length
+        if mask & IN_Q_OVERFLOW:
+            return None
+        if name:
+            names.append(os.fsdecode(name))
+    return names
+
+def is_video_file(path):
+    """是否為需要轉換的影片（忽略隱藏檔和暫存檔）"""
+    return not path.name.startswith('.') and path.suffix.lower() in VIDEO_EXTENSIONS
+
+def scan_directory(directory):
+    """列出資料夾中的影片檔案（只掃描一層）"""
+    with os.scandir(directory) as entries:
+        return [Path(entry.path) for entry in entries
+                if entry.is_file() and is_video_file(Path(entry.path))]
+
+def move_into(path, directory):
+    """將檔案移到指定資料夾，檔名衝突時加上序號"""
+    directory.mkdir(parents=True, exist_ok=True)
+    target = directory / path.name
+    counter = 1
+    while target.exists():
+        target = directory / f"{path.stem}.{counter}{path.suffix}"
+        counter += 1
+    shutil.move(str(path), str(target))
+    return target
+
+def unique_output_path(video_path, output_dir, reserved):
+    """影片的輸出路徑；已存在或已被進行中的轉換使用時加上序號
+
+    clip.mp4 和 clip.mov 會得到不同的輸出，同時轉換時也不會共用 .partial 和封面暫存檔。
+    """
+    target = output_dir / f"{video_path.stem}.MP.jpg"
+    counter = 1
+    while target in reserved or target.exists():
+        target = output_dir / f"{video_path.stem}.{counter}.MP.jpg"
+        counter += 1
+    return target
+
+def process_video(video_path, output_path, processed_dir, failed_dir, metrics=None):
+    """轉換單一影片，完成後將來源移出監看資料夾"""
+    success = convert_to_motion_photo(video_path, output_path, metrics=metrics)
+
+    if success:
+        target = move_into(video_path, processed_dir)
+        print(f"📦 來源已移至: {target}")
+    else:
+        target = move_into(video_path, failed_dir)
+        print(f"⚠️ 轉換失敗，來源已移至: {target}")
+    return success
+
+def watch_folder(directory, output_dir=None, processed_dir=None, failed_dir=None,
+                 workers=2, settle_seconds=2.0, poll_interval=1.0, use_inotify=True, metrics=None):
+    """監看資料夾並轉換寫入完成的影片"""
+    directory = Path(directory)
+    if not directory.is_dir():
+        print(f"❌ 找不到資料夾: {directory}")
+        return False
+
+    output_dir = Path(output_dir) if output_dir else directory
+    processed_dir = Path(processed_dir) if processed_dir else directory / 'processed'
+    failed_dir = Path(failed_dir) if failed_dir else directory / 'failed'
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    fd = open_inotify(directory) if use_inotify else None
+    mode = "inotify" if fd is not None else f"輪詢 (每 {poll_interval} 秒)"
+    print(f"👀 監看資料夾: {directory} [{mode}, {workers} 個工作執行緒]")
+
+    # 等待中的檔案: 路徑 -> (大小, 修改時間, 開始穩定的時間)
+    pending = {}
+    # 轉換中的檔案: 路徑 -> (Future, 輸出路徑)
+    running = {}
+    # 處理時發生錯誤且無法移出的檔案，不再重新處理
+    ignored = set()
+
+    def track(paths):
+        for path in paths:
+            if path not in pending and path not in running and path not in ignored:
+                pending[path] = (None, None, None)
+
+    # 啟動時先處理已經存在的檔案
+    track(scan_directory(directory))
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        while True:
+            # 等待新檔案
+            if fd is not None:
+                names = read_inotify_events(fd, poll_interval)
+                if names is None:
+                    track(scan_directory(directory))
+                else:
+                    track(directory / name for name in names if is_video_file(directory / name))
+            else:
+                time.sleep(poll_interval)
+                track(scan_directory(directory))
+
+            # 清除已完成的轉換；工作執行緒中的例外（例如無法移動來源）在這裡處理
+            for path in [path for path, (future, _) in running.items() if future.done()]:
+                future, _ = running.pop(path)
+                error = future.exception()
+                if error is None:
+                    continue
+                print(f"❌ 處理 {path} 時發生錯誤: {error}")
+                if not path.exists():
+                    continue
+                try:
+                    target = move_into(path, failed_dir)
+                    print(f"⚠️ 來源已移至: {target}")
+                except OSError as e:
+                    print(f"⚠️ 無法移動來源，之後不再處理: {path} ({e})")
+                    ignored.add(path)
+
+            # 檢查檔案大小是否已經穩定（不再被寫入）
+            now = time.monotonic()
+            for path, (size, mtime, stable_since) in list(pending.items()):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    del pending[path]
+                    continue
+
+                if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                    pending[path] = (stat.st_size, stat.st_mtime_ns, now)
+                elif stat.st_size > 0 and now - stable_since >= settle_seconds:
+                    del pending[path]
+                    output_path = unique_output_path(path, output_dir, {output for _, output in running.values()})
+                    print(f"📥 偵測到新影片: {path} → {output_path}")
+                    future = executor.submit(process_video, path, output_path, processed_dir, failed_dir, metrics)
+                    running[path] = (future, output_path)
+
+    except KeyboardInterrupt:
+        print("\n👋 停止監看，等待進行中的轉換完成...")
+    finally:
+        executor.shutdown(wait=True)
+        if fd is not None:
+            os.close(fd)
+
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description='監看資料夾並自動轉換影片為Motion Photo')
+    parser.add_argument('directory', help='監看的資料夾')
+    parser.add_argument('--output-dir', help='Motion Photo輸出資料夾（預設為監看資料夾）')
+    parser.add_argument('--processed-dir', help='轉換成功的來源移至此處（預設為 <資料夾>/processed）')
+    parser.add_argument('--failed-dir', help='轉換失敗的來源移至此處（預設為 <資料夾>/failed）')
+    parser.add_argument('--workers', type=int, default=2, help='同時轉換的數量（預設 2）')
+    parser.add_argument('--settle', type=float, default=2.0, help='檔案大小維持不變多少秒後才轉換（預設 2）')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='檢查間隔秒數（預設 1）')
+    parser.add_argument('--poll', action='store_true', help='不使用 inotify，改用輪詢')
+    parser.add_argument('--metrics-file', help='將Prometheus指標寫到此檔案，每次轉換後更新')
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error('--workers 必須至少為 1')
+
+    metrics = MetricsSink(args.metrics_file) if args.metrics_file else None
+    watch_folder(args.directory, args.output_dir, args.processed_dir, args.failed_dir,
+                 args.workers, args.settle, args.poll_interval, not args.poll, metrics)
+
+if __name__ == "__main__":
+    main()